@@ -1,79 +1,291 @@
 import os
 import re
+import glob
 import json
 import base64
+import hashlib
 import tempfile
 import shutil
-import importlib
 import uuid
 import time
+import math
+import zipfile
+import asyncio
 import threading
-from typing import Optional, List
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque
+from typing import Optional, List, Dict
 from urllib.parse import quote
 
 import requests
-from PIL import Image
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+from gerar_laudo import renderizar_laudo, carregar_planilhas, verificar_fotos, manifesto_fotos, IndiceFotos
 
 app = FastAPI()
 
-JOBS_FILE = "/tmp/laudo_jobs.json"
-_jobs_lock = threading.Lock()
+JOBS_DIR = "/tmp/laudo_jobs"
+RESULTADOS_DIR = "/tmp/laudo_resultados"
+BLOBS_DIR = "/tmp/laudo_blobs"
 JOB_TTL_SEGUNDOS = 3600
+BLOB_TTL_SEGUNDOS = 7 * 24 * 3600
+BLOB_MAX_BYTES = int(os.getenv("LAUDO_BLOB_MAX_MB", "4096")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+ZIP_MAX_ARQUIVOS = int(os.getenv("LAUDO_ZIP_MAX_ARQUIVOS", "5000"))
+ZIP_MAX_BYTES = int(os.getenv("LAUDO_ZIP_MAX_BYTES", str(4 * 1024 ** 3)))
+STATUS_ESPERA_MAX = 60
+STATUS_SSE_PING = 15
+GERACAO_WORKERS = int(os.getenv("LAUDO_GERACAO_WORKERS", str(os.cpu_count() or 2)))
+GERACAO_MAX_FILA = int(os.getenv("LAUDO_GERACAO_MAX_FILA", "20"))
+IO_WORKERS = int(os.getenv("LAUDO_IO_WORKERS", "8"))
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+ZIP_MEDIA_TYPE = "application/zip"
+
+os.makedirs(JOBS_DIR, exist_ok=True)
+os.makedirs(RESULTADOS_DIR, exist_ok=True)
+os.makedirs(BLOBS_DIR, exist_ok=True)
 
 
 # ─────────────────────── Jobs ───────────────────────
+# Cada job é um arquivo JSON próprio em JOBS_DIR (<job_id>.json), gravado de
+# forma atômica (arquivo temporário + os.replace). Ler ou atualizar um job não
+# depende da quantidade de jobs vivos. Blobs grandes (Excel, template, laudo
+# gerado) ficam em arquivos separados e nunca entram no registro de status;
+# o laudo gerado fica em RESULTADOS_DIR até ser baixado ou expirar.
+# Atualizações do tipo ler-modificar-gravar (itens de um lote) usam _jobs_lock.
+
+_jobs_lock = threading.Lock()
+
+_RE_JOB_ID = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def _job_path(job_id: str) -> Optional[str]:
+    if not job_id or not _RE_JOB_ID.match(job_id):
+        return None
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def _resultado_path(job_id: str) -> str:
+    return os.path.join(RESULTADOS_DIR, f"{job_id}.docx")
+
 
-def _ler_jobs() -> dict:
-    if not os.path.exists(JOBS_FILE):
-        return {}
+def _resultado_item_path(job_id: str, indice: int) -> str:
+    return os.path.join(RESULTADOS_DIR, f"{job_id}_{indice}.docx")
+
+
+def _resultado_zip_path(job_id: str) -> str:
+    return os.path.join(RESULTADOS_DIR, f"{job_id}.zip")
+
+
+def _get_job(job_id: str) -> Optional[dict]:
+    path = _job_path(job_id)
+    if not path or not os.path.exists(path):
+        return None
     try:
-        with open(JOBS_FILE, "r") as f:
+        with open(path, "r") as f:
             return json.load(f)
     except Exception:
-        return {}
+        return None
 
 
-def _salvar_jobs(jobs: dict):
+def _set_job(job_id: str, dados: dict):
+    path = _job_path(job_id)
+    if not path:
+        return
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
     try:
-        with open(JOBS_FILE, "w") as f:
-            json.dump(jobs, f)
+        with open(tmp, "w") as f:
+            json.dump(dados, f)
+        os.replace(tmp, path)
     except Exception as e:
-        print(f"[AVISO] Nao foi possivel salvar jobs: {e}")
+        print(f"[AVISO] Nao foi possivel salvar job {job_id}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return
+    _notificar(job_id)
 
 
-def _get_job(job_id: str) -> dict:
-    with _jobs_lock:
-        return _ler_jobs().get(job_id)
+def _delete_job(job_id: str):
+    path = _job_path(job_id)
+    if not path:
+        return
+    for arquivo in [path] + glob.glob(os.path.join(RESULTADOS_DIR, f"{job_id}*")):
+        try:
+            os.remove(arquivo)
+        except FileNotFoundError:
+            pass
+    _notificar(job_id, removido=True)
 
 
-def _set_job(job_id: str, dados: dict):
-    with _jobs_lock:
-        jobs = _ler_jobs()
-        jobs[job_id] = dados
-        _salvar_jobs(jobs)
+def _limpar_jobs_antigos():
+    agora = time.time()
+    expirados = 0
+    for nome in os.listdir(JOBS_DIR):
+        if not nome.endswith(".json"):
+            continue
+        job_id = nome[:-len(".json")]
+        job = _get_job(job_id)
+        if job is None or agora - job.get("criado_em", 0) <= JOB_TTL_SEGUNDOS:
+            continue
+        work = job.get("work_dir", "")
+        if work and os.path.isdir(work):
+            shutil.rmtree(work, ignore_errors=True)
+        _delete_job(job_id)
+        expirados += 1
+    if expirados:
+        print(f"[INFO] {expirados} job(s) expirado(s) removido(s).")
+    _limpar_blobs_antigos()
+
+
+# ─────────────────────── Notificação de mudanças ───────────────────────
+# Cada mudança de um job (_set_job, _delete_job, início na fila de geração)
+# incrementa a versão dele em memória e acorda quem está esperando em
+# /status/{id}/aguardar ou /status/{id}/eventos. Quem espera só relê o
+# registro do job depois de uma mudança, em vez de consultar o disco em laço.
+# As mudanças vêm de threads (pools de I/O e de geração); os ouvintes são
+# asyncio.Event acordados no loop deles via call_soon_threadsafe.
+
+_ouvintes_lock = threading.Lock()
+_versoes: Dict[str, int] = {}
+_ouvintes: Dict[str, set] = {}
+
+
+def _versao_job(job_id: str) -> int:
+    with _ouvintes_lock:
+        return _versoes.get(job_id, 0)
+
+
+def _notificar(job_id: str, removido: bool = False):
+    with _ouvintes_lock:
+        if removido:
+            _versoes.pop(job_id, None)
+        else:
+            _versoes[job_id] = _versoes.get(job_id, 0) + 1
+        ouvintes = list(_ouvintes.get(job_id, ()))
+    for loop, evento in ouvintes:
+        try:
+            loop.call_soon_threadsafe(evento.set)
+        except RuntimeError:
+            pass  # loop já encerrado
+
+
+async def _aguardar_mudanca(job_id: str, versao: int, espera: float) -> int:
+    """Espera a versão do job deixar de ser 'versao' (ou o tempo acabar); retorna a versão atual."""
+    evento = asyncio.Event()
+    ouvinte = (asyncio.get_running_loop(), evento)
+    with _ouvintes_lock:
+        if _versoes.get(job_id, 0) != versao:
+            return _versoes.get(job_id, 0)
+        _ouvintes.setdefault(job_id, set()).add(ouvinte)
+    try:
+        await asyncio.wait_for(evento.wait(), espera)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        with _ouvintes_lock:
+            restantes = _ouvintes.get(job_id)
+            if restantes is not None:
+                restantes.discard(ouvinte)
+                if not restantes:
+                    del _ouvintes[job_id]
+    return _versao_job(job_id)
+
+
+# ─────────────────────── Blobs ───────────────────────
+# Excel e template enviados uma vez (POST /blob) e referenciados pelo sha256
+# do conteúdo em /iniciar (excel_hash / template_hash). Cada blob é um arquivo
+# BLOBS_DIR/<sha256>; o uso renova o mtime e blobs sem uso por
+# BLOB_TTL_SEGUNDOS são removidos. Acima de BLOB_MAX_BYTES, os menos usados
+# recentemente saem primeiro (LRU pelo mtime) até sobrar 90% do limite.
+# A limpeza roda ao receber um blob e ao fim de cada job (_limpar_jobs_antigos).
+# As fotos recebidas também entram aqui (hard link do arquivo do job), para que
+# o manifesto de um novo job reaproveite fotos já enviadas pelo hash: uma foto
+# continua em disco até BLOB_TTL_SEGUNDOS depois do último uso, mesmo com o
+# work_dir do job já removido.
+# Um arquivo do job pode ser o mesmo inode de um blob: quem grava por cima
+# sempre remove o arquivo antes (_novo_arquivo), nunca trunca.
+
+_RE_BLOB_HASH = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _blob_path(blob_hash: str) -> Optional[str]:
+    if not blob_hash or not _RE_BLOB_HASH.match(blob_hash):
+        return None
+    return os.path.join(BLOBS_DIR, blob_hash)
+
+
+def _copiar_blob(blob_hash: str, destino: str):
+    """Coloca o blob em destino (hard link quando possível); renova o mtime do blob."""
+    path = _blob_path(blob_hash)
+    if not path or not os.path.exists(path):
+        raise Exception(f"Blob {blob_hash} nao encontrado; envie o arquivo em /blob.")
+    os.utime(path)
+    try:
+        os.link(path, destino)
+    except OSError:
+        shutil.copyfile(path, destino)
 
 
-def _delete_job(job_id: str):
-    with _jobs_lock:
-        jobs = _ler_jobs()
-        jobs.pop(job_id, None)
-        _salvar_jobs(jobs)
+def _registrar_blob(caminho: str, blob_hash: str):
+    """Guarda caminho (arquivo já gravado) como blob <blob_hash>, se ainda não existir."""
+    path = _blob_path(blob_hash)
+    if os.path.exists(path):
+        os.utime(path)
+        return
+    try:
+        os.link(caminho, path)
+    except FileExistsError:
+        pass
+    except OSError:
+        fd, tmp = tempfile.mkstemp(dir=BLOBS_DIR, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(caminho, tmp)
+        os.replace(tmp, path)
+
+
+def _novo_arquivo(destino: str):
+    """Remove destino antes de regravá-lo (pode ser hard link de um blob)."""
+    try:
+        os.remove(destino)
+    except FileNotFoundError:
+        pass
 
 
-def _limpar_jobs_antigos():
+def _limpar_blobs_antigos():
     agora = time.time()
-    with _jobs_lock:
-        jobs = _ler_jobs()
-        expirados = [jid for jid, j in jobs.items()
-                     if agora - j.get("criado_em", 0) > JOB_TTL_SEGUNDOS]
-        for jid in expirados:
-            del jobs[jid]
-        if expirados:
-            _salvar_jobs(jobs)
-            print(f"[INFO] {len(expirados)} job(s) expirado(s) removido(s).")
+    blobs = []
+    removidos = 0
+    for nome in os.listdir(BLOBS_DIR):
+        path = os.path.join(BLOBS_DIR, nome)
+        try:
+            st = os.stat(path)
+            if agora - st.st_mtime > BLOB_TTL_SEGUNDOS:
+                os.remove(path)
+                removidos += 1
+            elif not nome.endswith(".tmp"):
+                blobs.append((st.st_mtime, st.st_size, path))
+        except FileNotFoundError:
+            pass
+
+    total = sum(tam for _, tam, _ in blobs)
+    if total > BLOB_MAX_BYTES:
+        alvo = int(BLOB_MAX_BYTES * 0.9)
+        for _, tam, path in sorted(blobs):
+            if total <= alvo:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= tam
+            removidos += 1
+    if removidos:
+        print(f"[INFO] {removidos} blob(s) removido(s); {total} bytes em blobs.")
 
 
 # ─────────────────────── Utilitários ───────────────────────
@@ -87,48 +299,21 @@ def normalizar_rel_path(path: str) -> str:
     return rel
 
 
-def eh_imagem(caminho: str) -> bool:
-    ext = os.path.splitext(caminho)[1].lower()
-    return ext in {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
-
-
-def comprimir_imagem_no_mesmo_arquivo(caminho: str, max_lado: int = 1600, qualidade: int = 75):
-    if not os.path.exists(caminho) or not eh_imagem(caminho):
-        return
-    try:
-        novo_caminho = caminho
-        with Image.open(caminho) as img:
-            img.thumbnail((max_lado, max_lado))
-            if img.mode in ("RGBA", "LA", "P"):
-                fundo = Image.new("RGB", img.size, (255, 255, 255))
-                if img.mode == "P":
-                    img = img.convert("RGBA")
-                fundo.paste(img, mask=img.split()[-1] if img.mode in ("RGBA", "LA") else None)
-                img = fundo
-            elif img.mode != "RGB":
-                img = img.convert("RGB")
-            ext = os.path.splitext(caminho)[1].lower()
-            if ext in {".jpg", ".jpeg"}:
-                img.save(caminho, format="JPEG", quality=qualidade, optimize=True)
-                return
-            novo_caminho = os.path.splitext(caminho)[0] + ".jpg"
-            img.save(novo_caminho, format="JPEG", quality=qualidade, optimize=True)
-        if novo_caminho != caminho and os.path.exists(caminho):
-            os.remove(caminho)
-    except Exception as e:
-        print(f"[AVISO] Falha ao comprimir imagem '{caminho}': {e}")
-
-
-def preparar_excel(work_dir: str, excel_base64: str) -> str:
+def preparar_excel(work_dir: str, excel_base64: Optional[str], excel_hash: Optional[str] = None) -> str:
     excel_path = os.path.join(work_dir, "Cautelar.xlsx")
+    if excel_hash:
+        _copiar_blob(excel_hash, excel_path)
+        return excel_path
     with open(excel_path, "wb") as f:
         f.write(base64.b64decode(excel_base64))
     return excel_path
 
 
-def preparar_template(work_dir: str, template_base64: Optional[str]) -> str:
+def preparar_template(work_dir: str, template_base64: Optional[str], template_hash: Optional[str] = None) -> str:
     dst_template = os.path.join(work_dir, "tamplete.docx")
-    if template_base64:
+    if template_hash:
+        _copiar_blob(template_hash, dst_template)
+    elif template_base64:
         with open(dst_template, "wb") as f:
             f.write(base64.b64decode(template_base64))
     else:
@@ -139,64 +324,214 @@ def preparar_template(work_dir: str, template_base64: Optional[str]) -> str:
     return dst_template
 
 
-def localizar_docx_gerado(work_dir: str) -> str:
-    out_dir = os.path.join(work_dir, "saida")
-    if not os.path.isdir(out_dir):
-        raise Exception(f"Pasta de saida nao encontrada: {out_dir}")
-    docx_files = [
-        os.path.join(out_dir, nome)
-        for nome in os.listdir(out_dir)
-        if nome.lower().endswith(".docx")
-    ]
-    if not docx_files:
-        raise Exception("Laudo nao foi gerado (nenhum .docx na pasta de saida).")
-    docx_files.sort(key=os.path.getmtime, reverse=True)
-    return docx_files[0]
+# ─────────────────────── Processamento ───────────────────────
+# A geração (pandas + Pillow + docxtpl) roda num pool de processos, fora do
+# processo web, via renderizar_laudo (sem estado global nem reload do módulo).
+# LAUDO_GERACAO_WORKERS limita quantos laudos são gerados ao mesmo tempo; os
+# demais aguardam na fila de geração (abaixo), não na fila interna do pool.
+# Cada laudo prepara as fotos com LAUDO_IMG_WORKERS threads (gerar_laudo), cujo
+# padrão é cpu_count // LAUDO_GERACAO_WORKERS: o total na máquina fica em
+# torno de cpu_count.
+
+_geracao_lock = threading.Lock()
+_geracao_executor = None
+
+
+def _executor_geracao(reiniciar: bool = False) -> ProcessPoolExecutor:
+    global _geracao_executor
+    with _geracao_lock:
+        if reiniciar and _geracao_executor is not None:
+            _geracao_executor.shutdown(wait=False, cancel_futures=True)
+            _geracao_executor = None
+        if _geracao_executor is None:
+            _geracao_executor = ProcessPoolExecutor(
+                max_workers=GERACAO_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _geracao_executor
+
+
+def _gerar_no_processo(work: str, id_vistoria: str, destino: str, carga_seletiva: Optional[bool] = None) -> str:
+    """Executado num processo do pool: grava o laudo em destino e retorna o nome do arquivo."""
+    try:
+        return renderizar_laudo(
+            id_vistoria,
+            excel=os.path.join(work, "Cautelar.xlsx"),
+            template=os.path.join(work, "tamplete.docx"),
+            fotos_dir=work,
+            saida=destino,
+            carga_seletiva=carga_seletiva,
+        )
+    except Exception:
+        if os.path.exists(destino):
+            os.remove(destino)
+        raise
+
+
+def _aquecer_planilhas(work: str):
+    """Executado num processo do pool: lê o workbook uma vez e deixa no cache de planilhas."""
+    carregar_planilhas(os.path.join(work, "Cautelar.xlsx"))
 
 
-def gerar_laudo_no_modulo(id_vistoria: str):
-    import gerar_laudo as gl
-    importlib.reload(gl)
-    gl.gerar_laudo(id_vistoria)
+def _submeter(fn, *args):
+    try:
+        return _executor_geracao().submit(fn, *args)
+    except BrokenProcessPool:
+        return _executor_geracao(reiniciar=True).submit(fn, *args)
 
 
-# ─────────────────────── Processamento ───────────────────────
+def _no_pool(fn, *args):
+    """
+    Roda fn num processo do pool de geração e espera o resultado. Para consultas
+    que leem a planilha (pandas/openpyxl) fora do processo web; o cache de
+    planilhas aquecido fica nos processos que depois geram o laudo.
+    """
+    try:
+        return _submeter(fn, *args).result()
+    except BrokenProcessPool:
+        _executor_geracao(reiniciar=True)
+        raise HTTPException(status_code=503, detail="Pool de geracao reiniciado; tente novamente.")
+
+
+def _faltando_no_processo(work: str, ids_vistoria: list, carga_seletiva: Optional[bool]) -> tuple:
+    """Executado num processo do pool: (faltando, erros) de /fotos/{job_id}/faltando."""
+    excel = os.path.join(work, "Cautelar.xlsx")
+    faltando, erros = [], []
+    for id_vistoria in ids_vistoria:
+        try:
+            itens = verificar_fotos(id_vistoria, excel, work, carga_seletiva=carga_seletiva)
+        except ValueError as e:
+            erros.append({"id_vistoria": id_vistoria, "error": str(e)})
+            continue
+        faltando.extend({"id_vistoria": id_vistoria, **f} for f in itens)
+    return faltando, erros
+
+
+def _manifesto_no_processo(work: str, ids_vistoria: list, carga_seletiva: Optional[bool]) -> tuple:
+    """Executado num processo do pool: (fotos sem repetição, erros) de /manifesto/{job_id}."""
+    excel = os.path.join(work, "Cautelar.xlsx")
+    fotos, erros = [], []
+    for id_vistoria in ids_vistoria:
+        try:
+            fotos.extend(manifesto_fotos(id_vistoria, excel, carga_seletiva=carga_seletiva))
+        except ValueError as e:
+            erros.append({"id_vistoria": id_vistoria, "error": str(e)})
+    return list(dict.fromkeys(fotos)), erros
+
+
+# ─────────────────────── Fila de geração ───────────────────────
+# Cada job com tarefas pendentes ocupa uma entrada de _fila (na ordem de
+# chegada); o pool recebe no máximo GERACAO_WORKERS tarefas por vez e as
+# entradas são atendidas em rodízio, uma tarefa por vez: um lote de 20 laudos
+# não segura os jobs que chegaram depois dele.
+# Com GERACAO_MAX_FILA jobs na fila, /gerar responde 429 com Retry-After
+# estimado pela duração média das tarefas. O estado é só deste processo.
+
+_fila_lock = threading.Lock()
+_fila = OrderedDict()        # job_id -> deque[(fn, args, ao_concluir)]
+_fila_sem_inicio = set()     # jobs da fila que ainda não tiveram tarefa despachada
+_em_execucao = 0
+_duracao_media = 10.0        # segundos por tarefa (média móvel)
+
+
+def _enfileirar(job_id: str, tarefas: list, limitar: bool = True):
+    """
+    Coloca as tarefas do job na fila de geração. limitar=False é usado para a
+    continuação de um job já admitido (itens de um lote após o aquecimento).
+    """
+    with _fila_lock:
+        if limitar and job_id not in _fila and len(_fila) >= GERACAO_MAX_FILA:
+            espera = max(1, math.ceil(_duracao_media * len(_fila) / GERACAO_WORKERS))
+            raise HTTPException(
+                status_code=429,
+                detail=f"Fila de geracao cheia ({len(_fila)} jobs). Tente novamente em {espera}s.",
+                headers={"Retry-After": str(espera)},
+            )
+        _fila.setdefault(job_id, deque()).extend(tarefas)
+        if limitar:
+            _fila_sem_inicio.add(job_id)
+    if limitar:
+        _notificar(job_id)
+    _despachar()
+
+
+def _despachar():
+    global _em_execucao
+    while True:
+        with _fila_lock:
+            if _em_execucao >= GERACAO_WORKERS or not _fila:
+                return
+            job_id, tarefas = next(iter(_fila.items()))
+            fn, args, ao_concluir = tarefas.popleft()
+            if tarefas:
+                _fila.move_to_end(job_id)
+            else:
+                del _fila[job_id]
+            iniciou = job_id in _fila_sem_inicio
+            _fila_sem_inicio.discard(job_id)
+            _em_execucao += 1
+        if iniciou:
+            _notificar(job_id)
+        inicio = time.monotonic()
+        futuro = _submeter(fn, *args)
+        futuro.add_done_callback(
+            lambda f, inicio=inicio, ao_concluir=ao_concluir: _tarefa_concluida(f, inicio, ao_concluir))
+
+
+def _tarefa_concluida(futuro, inicio: float, ao_concluir):
+    global _em_execucao, _duracao_media
+    with _fila_lock:
+        _em_execucao -= 1
+        if not futuro.cancelled() and futuro.exception() is None:
+            _duracao_media = 0.8 * _duracao_media + 0.2 * (time.monotonic() - inicio)
+    _despachar()
+    ao_concluir(futuro)
+
+
+def _posicao_na_fila(job_id: str) -> Optional[int]:
+    """Posição (1 = próximo) de um job que ainda não começou; None se já começou ou não está na fila."""
+    with _fila_lock:
+        if job_id not in _fila_sem_inicio:
+            return None
+        return list(_fila).index(job_id) + 1
+
 
 def _processar_job_v2(job_id: str):
     job = _get_job(job_id)
     if not job:
         print(f"[ERRO] Job {job_id} nao encontrado para processar.")
         return
+    if job.get("ids_vistoria"):
+        _processar_lote_laudos(job_id, job)
+        return
 
-    work = job.get("work_dir", "")
+    _set_job(job_id, {**job, "status": "running"})
     try:
-        _set_job(job_id, {**job, "status": "running"})
+        _enfileirar(job_id, [(
+            _gerar_no_processo,
+            (job["work_dir"], job["id_vistoria"], _resultado_path(job_id)),
+            lambda f: _concluir_job(job_id, job, f),
+        )])
+    except HTTPException:
+        _set_job(job_id, job)
+        raise
 
-        print(f"========== JOB {job_id} GERANDO ==========")
-        print(f"[INFO] id_vistoria={job['id_vistoria']}")
+    print(f"========== JOB {job_id} GERANDO ==========")
+    print(f"[INFO] id_vistoria={job['id_vistoria']}")
 
-        os.environ["LAUDO_BASE_DIR"] = work
 
-        preparar_excel(work, job["excel_base64"])
-        preparar_template(work, job.get("template_base64") or None)
-
-        gerar_laudo_no_modulo(job["id_vistoria"])
-
-        out_path = localizar_docx_gerado(work)
-        filename = os.path.basename(out_path)
-
-        with open(out_path, "rb") as f:
-            docx_b64 = base64.b64encode(f.read()).decode("utf-8")
+def _concluir_job(job_id: str, job: dict, futuro):
+    work = job.get("work_dir", "")
+    try:
+        filename = futuro.result()
 
         _set_job(job_id, {
             "status": "done",
-            "result": {"filename": filename, "docx_base64": docx_b64},
+            "result": {"filename": filename},
             "error": None,
             "criado_em": job.get("criado_em", time.time()),
             "work_dir": "",
-            "id_vistoria": job["id_vistoria"],
-            "excel_base64": "",
-            "template_base64": ""
+            "id_vistoria": job["id_vistoria"]
         })
         print(f"[INFO] JOB {job_id} CONCLUIDO: {filename}")
 
@@ -205,6 +540,8 @@ def _processar_job_v2(job_id: str):
         print(f"=== ERRO NO JOB {job_id} ===")
         print(traceback.format_exc())
         _set_job(job_id, {**job, "status": "error", "error": str(e)})
+        if isinstance(e, BrokenProcessPool):
+            _executor_geracao(reiniciar=True)
 
     finally:
         if work and os.path.isdir(work):
@@ -212,12 +549,103 @@ def _processar_job_v2(job_id: str):
         _limpar_jobs_antigos()
 
 
+# ─────────────────────── Lote de laudos ───────────────────────
+# Um job de lote gera vários laudos (ids_vistoria) com o mesmo workbook e as
+# mesmas fotos: o workbook é lido uma vez (cache de planilhas), as fotos ficam
+# num único work_dir e cada vistoria vira uma tarefa na fila de geração.
+# O progresso fica em job["itens"]; ao final é montado um .zip com os laudos.
+
+def _processar_lote_laudos(job_id: str, job: dict):
+    itens = [{"id_vistoria": v, "status": "pending", "filename": None, "error": None}
+             for v in job["ids_vistoria"]]
+    _set_job(job_id, {**job, "status": "running", "itens": itens})
+
+    def disparar_itens(_):
+        _enfileirar(job_id, [(
+            _gerar_no_processo,
+            (job["work_dir"], item["id_vistoria"], _resultado_item_path(job_id, indice), False),
+            lambda f, indice=indice: _concluir_item_lote(job_id, indice, f),
+        ) for indice, item in enumerate(itens)], limitar=False)
+
+    try:
+        _enfileirar(job_id, [(_aquecer_planilhas, (job["work_dir"],), disparar_itens)])
+    except HTTPException:
+        _set_job(job_id, job)
+        raise
+
+    print(f"========== JOB {job_id} GERANDO LOTE ({len(itens)} laudos) ==========")
+
+
+def _concluir_item_lote(job_id: str, indice: int, futuro):
+    with _jobs_lock:
+        job = _get_job(job_id)
+        if not job:
+            return
+        item = job["itens"][indice]
+        try:
+            item["filename"] = futuro.result()
+            item["status"] = "done"
+            print(f"[INFO] JOB {job_id} item {item['id_vistoria']} CONCLUIDO: {item['filename']}")
+        except Exception as e:
+            item["status"] = "error"
+            item["error"] = str(e)
+            print(f"=== ERRO NO JOB {job_id} item {item['id_vistoria']}: {e} ===")
+            if isinstance(e, BrokenProcessPool):
+                _executor_geracao(reiniciar=True)
+
+        if all(i["status"] in ("done", "error") for i in job["itens"]):
+            _finalizar_lote(job_id, job)
+        _set_job(job_id, job)
+
+    if job["status"] in ("done", "error"):
+        _limpar_jobs_antigos()
+
+
+def _finalizar_lote(job_id: str, job: dict):
+    """Monta o .zip com os laudos gerados e encerra o job (altera 'job' no lugar)."""
+    concluidos = [(i, item) for i, item in enumerate(job["itens"]) if item["status"] == "done"]
+    nomes = set()
+    with zipfile.ZipFile(_resultado_zip_path(job_id), "w", zipfile.ZIP_STORED) as zf:
+        for indice, item in concluidos:
+            nome = item["filename"]
+            if nome in nomes:
+                nome = f"{os.path.splitext(nome)[0]}_{item['id_vistoria']}.docx"
+            nomes.add(nome)
+            zf.write(_resultado_item_path(job_id, indice), nome)
+
+    job["status"] = "done" if concluidos else "error"
+    job["error"] = None if concluidos else "Nenhum laudo do lote foi gerado."
+    job["result"] = {"filename": f"Laudos_{job_id}.zip"}
+
+    work = job.get("work_dir", "")
+    if work and os.path.isdir(work):
+        shutil.rmtree(work, ignore_errors=True)
+    job["work_dir"] = ""
+    print(f"[INFO] JOB {job_id} LOTE CONCLUIDO: {len(concluidos)}/{len(job['itens'])}")
+
+
+# ─────────────────────── Trabalho bloqueante ───────────────────────
+# Os handlers async não fazem I/O no event loop: disco, base64, sha256, zip e
+# leitura/gravação do registro do job rodam num pool de threads próprio e
+# limitado (LAUDO_IO_WORKERS). Assim um upload grande não trava /health nem
+# /status, e os uploads não disputam o threadpool dos endpoints síncronos.
+
+_io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="laudo_io")
+
+
+async def _em_thread(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, fn, *args)
+
+
 # ─────────────────────── Models ───────────────────────
 
 class PayloadIniciar(BaseModel):
-    id_vistoria: str
-    excel_base64: str
+    id_vistoria: Optional[str] = None
+    ids_vistoria: Optional[List[str]] = None   # lote: vários laudos no mesmo job
+    excel_base64: Optional[str] = None
+    excel_hash: Optional[str] = None           # sha256 retornado por POST /blob
     template_base64: Optional[str] = None
+    template_hash: Optional[str] = None
 
 
 class PayloadFoto(BaseModel):
@@ -225,6 +653,10 @@ class PayloadFoto(BaseModel):
     b64: str
 
 
+class PayloadManifesto(BaseModel):
+    hashes: Optional[Dict[str, str]] = None   # path -> sha256 do conteúdo, calculado pelo cliente
+
+
 # ─────────────────────── Endpoints ───────────────────────
 
 @app.get("/health")
@@ -234,28 +666,99 @@ def health():
 
 @app.post("/iniciar")
 async def iniciar(p: PayloadIniciar):
-    """Cria o job e reserva diretório de trabalho. Retorna job_id."""
+    """
+    Cria o job e reserva diretório de trabalho. Retorna job_id.
+    Informe 'id_vistoria' (um laudo) ou 'ids_vistoria' (lote de laudos).
+    Excel e template podem vir em base64 ou pelo hash de um blob já enviado
+    (excel_hash / template_hash, ver POST /blob).
+    """
+    if bool(p.id_vistoria) == bool(p.ids_vistoria):
+        raise HTTPException(status_code=400, detail="Informe 'id_vistoria' ou 'ids_vistoria' (apenas um).")
+    if bool(p.excel_base64) == bool(p.excel_hash):
+        raise HTTPException(status_code=400, detail="Informe 'excel_base64' ou 'excel_hash' (apenas um).")
+    if p.template_base64 and p.template_hash:
+        raise HTTPException(status_code=400, detail="Informe 'template_base64' ou 'template_hash' (apenas um).")
+
+    job_id = await _em_thread(_criar_job, p)
+    return JSONResponse({"job_id": job_id}, status_code=202)
+
+
+def _criar_job(p: PayloadIniciar) -> str:
     job_id = str(uuid.uuid4())
     work = tempfile.mkdtemp(prefix="laudo_")
 
+    try:
+        preparar_excel(work, p.excel_base64, p.excel_hash)
+        preparar_template(work, p.template_base64 or None, p.template_hash)
+    except Exception as e:
+        shutil.rmtree(work, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=f"Falha ao preparar arquivos do job: {e}")
+
     _set_job(job_id, {
         "status": "aguardando_fotos",
         "work_dir": work,
         "id_vistoria": p.id_vistoria,
-        "excel_base64": p.excel_base64,
-        "template_base64": p.template_base64 or "",
+        "ids_vistoria": p.ids_vistoria,
         "result": None,
         "error": None,
         "criado_em": time.time()
     })
 
-    print(f"[INFO] Job iniciado: {job_id} | vistoria={p.id_vistoria}")
-    return JSONResponse({"job_id": job_id}, status_code=202)
+    print(f"[INFO] Job iniciado: {job_id} | vistoria={p.id_vistoria or ', '.join(p.ids_vistoria)}")
+    return job_id
+
 
+@app.post("/blob")
+async def enviar_blob(arquivo: UploadFile = File(...)):
+    """
+    Guarda um Excel ou template (multipart, campo 'arquivo') e retorna o sha256
+    do conteúdo, para usar em /iniciar como excel_hash / template_hash.
+    Reenviar o mesmo conteúdo retorna o mesmo hash.
+    """
+    try:
+        blob_hash, tamanho = await _em_thread(_salvar_blob, arquivo.file)
+    finally:
+        await arquivo.close()
+    return JSONResponse({"hash": blob_hash, "tamanho": tamanho})
 
-@app.post("/foto/{job_id}")
-async def receber_foto(job_id: str, p: PayloadFoto):
-    """Recebe uma foto por vez (base64) e salva no diretório do job."""
+
+def _salvar_blob(origem) -> tuple:
+    fd, tmp = tempfile.mkstemp(dir=BLOBS_DIR, suffix=".tmp")
+    sha = hashlib.sha256()
+    tamanho = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                bloco = origem.read(UPLOAD_CHUNK_BYTES)
+                if not bloco:
+                    break
+                sha.update(bloco)
+                f.write(bloco)
+                tamanho += len(bloco)
+        if not tamanho:
+            raise HTTPException(status_code=400, detail="Campo 'arquivo' invalido ou vazio.")
+        blob_hash = sha.hexdigest()
+        os.replace(tmp, _blob_path(blob_hash))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    _limpar_blobs_antigos()
+    print(f"[INFO] Blob salvo: {blob_hash} ({tamanho} bytes)")
+    return blob_hash, tamanho
+
+
+@app.get("/blob/{blob_hash}")
+def consultar_blob(blob_hash: str):
+    """Indica se o blob já está no servidor (200) ou precisa ser enviado (404)."""
+    path = _blob_path(blob_hash)
+    if not path or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Blob nao encontrado.")
+    return JSONResponse({"hash": blob_hash, "tamanho": os.path.getsize(path)})
+
+
+def _work_dir_do_job(job_id: str) -> str:
+    """Valida o job e retorna seu diretório de trabalho."""
     job = _get_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job nao encontrado.")
@@ -263,29 +766,276 @@ async def receber_foto(job_id: str, p: PayloadFoto):
     work = job.get("work_dir", "")
     if not work or not os.path.isdir(work):
         raise HTTPException(status_code=400, detail="Diretorio de trabalho invalido ou expirado.")
+    return work
 
-    rel = normalizar_rel_path(p.path)
+
+def _destino_foto(work: str, path: str) -> tuple:
+    """
+    Normaliza o path enviado; retorna (rel, destino) dentro do work_dir.
+    Paths com '..', absolutos ou com letra de drive são recusados (400).
+    """
+    rel = normalizar_rel_path(path)
     if not rel:
         raise HTTPException(status_code=400, detail="Campo 'path' invalido ou vazio.")
-    if not p.b64:
-        raise HTTPException(status_code=400, detail="Campo 'b64' invalido ou vazio.")
+    if ".." in rel.split("/") or os.path.isabs(rel) or os.path.splitdrive(rel)[0] or re.match(r"^[A-Za-z]:", rel):
+        raise HTTPException(status_code=400, detail=f"Path invalido (fora do diretorio do job): {path}")
 
     destino = os.path.join(work, rel)
     os.makedirs(os.path.dirname(destino), exist_ok=True)
-
+    return rel, destino
+
+
+def _gravar_em_blocos(origem, destino: str, limite: Optional[int] = None) -> int:
+    """
+    Copia um arquivo aberto para destino em blocos; retorna o total de bytes.
+    A foto gravada é registrada como blob (sha256 calculado durante a cópia).
+    Com 'limite', passar desse total apaga o destino e levanta ValueError.
+    """
+    _novo_arquivo(destino)
+    sha = hashlib.sha256()
+    tamanho = 0
     with open(destino, "wb") as f:
-        f.write(base64.b64decode(p.b64))
+        while True:
+            bloco = origem.read(UPLOAD_CHUNK_BYTES)
+            if not bloco:
+                break
+            tamanho += len(bloco)
+            if limite is not None and tamanho > limite:
+                f.close()
+                os.remove(destino)
+                raise ValueError(f"Conteudo maior que o tamanho declarado ({limite} bytes).")
+            sha.update(bloco)
+            f.write(bloco)
+    if tamanho:
+        _registrar_blob(destino, sha.hexdigest())
+    return tamanho
+
+
+@app.post("/foto/{job_id}", openapi_extra={"requestBody": {
+    "required": True, "content": {"application/json": {"schema": PayloadFoto.model_json_schema()}}}})
+async def receber_foto(job_id: str, request: Request):
+    """
+    Recebe uma foto por vez (JSON PayloadFoto, base64) e salva no diretório do job.
+    O corpo é lido cru e validado/decodificado fora do event loop.
+    """
+    corpo = await request.body()
+    rel = await _em_thread(_salvar_foto_b64, job_id, corpo)
+    return JSONResponse({"ok": True, "path": rel})
 
-    if eh_imagem(destino):
-        comprimir_imagem_no_mesmo_arquivo(destino)
+
+def _salvar_foto_b64(job_id: str, corpo: bytes) -> str:
+    try:
+        p = PayloadFoto.model_validate_json(corpo)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+    if not p.b64:
+        raise HTTPException(status_code=400, detail="Campo 'b64' invalido ou vazio.")
+    rel, destino = _destino_foto(_work_dir_do_job(job_id), p.path)
+
+    # Decodifica em fatias (múltiplas de 4 caracteres) em vez de um
+    # b64decode único: entre as fatias o GIL volta ao event loop.
+    b64 = p.b64
+    if "\n" in b64 or "\r" in b64 or " " in b64:
+        b64 = "".join(b64.split())  # base64 quebrado em linhas desalinharia as fatias
+    passo = UPLOAD_CHUNK_BYTES // 3 * 4
+    sha = hashlib.sha256()
+    _novo_arquivo(destino)
+    with open(destino, "wb") as f:
+        for i in range(0, len(b64), passo):
+            bloco = base64.b64decode(b64[i:i + passo])
+            sha.update(bloco)
+            f.write(bloco)
+    _registrar_blob(destino, sha.hexdigest())
 
     print(f"[INFO] Foto salva: {rel}")
+    return rel
+
+
+@app.post("/foto/{job_id}/arquivo")
+async def receber_foto_arquivo(job_id: str, path: str = Form(...), arquivo: UploadFile = File(...)):
+    """
+    Recebe uma foto por vez como multipart/form-data (campos 'path' e 'arquivo').
+    O conteúdo é gravado em blocos de UPLOAD_CHUNK_BYTES, sem base64 e sem
+    carregar a imagem inteira em memória.
+    """
+    try:
+        rel = await _em_thread(_salvar_foto_arquivo, job_id, path, arquivo.file)
+    finally:
+        await arquivo.close()
     return JSONResponse({"ok": True, "path": rel})
 
 
+def _salvar_foto_arquivo(job_id: str, path: str, origem) -> str:
+    rel, destino = _destino_foto(_work_dir_do_job(job_id), path)
+
+    if not _gravar_em_blocos(origem, destino):
+        os.remove(destino)
+        raise HTTPException(status_code=400, detail="Campo 'arquivo' invalido ou vazio.")
+
+    print(f"[INFO] Foto salva: {rel}")
+    return rel
+
+
+def _eh_zip(arquivo: UploadFile) -> bool:
+    nome = (arquivo.filename or "").lower()
+    return nome.endswith(".zip") or arquivo.content_type in ("application/zip", "application/x-zip-compressed")
+
+
+def _salvar_lote(work: str, arquivos: List[UploadFile], paths: Optional[List[str]]) -> List[dict]:
+    """
+    Grava no work_dir cada parte do lote. Partes .zip são extraídas mantendo a
+    estrutura de pastas (ex.: Fotos_imovel_Images/...). Retorna um resultado por
+    arquivo, na ordem de envio.
+    Um zip com mais de ZIP_MAX_ARQUIVOS entradas ou mais de ZIP_MAX_BYTES
+    descompactados é recusado inteiro, antes de extrair qualquer entrada.
+    """
+    resultados = []
+
+    def gravar(path, origem, limite=None):
+        try:
+            rel, destino = _destino_foto(work, path)
+        except HTTPException as e:
+            resultados.append({"path": path, "ok": False, "error": e.detail})
+            return
+        try:
+            tamanho = _gravar_em_blocos(origem, destino, limite)
+        except ValueError as e:
+            resultados.append({"path": rel, "ok": False, "error": str(e)})
+            return
+        if not tamanho:
+            os.remove(destino)
+            resultados.append({"path": rel, "ok": False, "error": "Arquivo vazio."})
+            return
+        resultados.append({"path": rel, "ok": True})
+
+    paths = list(paths or [])
+    for arquivo in arquivos:
+        if _eh_zip(arquivo):
+            try:
+                with zipfile.ZipFile(arquivo.file) as zf:
+                    entradas = [info for info in zf.infolist() if not info.is_dir()]
+                    total = sum(info.file_size for info in entradas)
+                    if len(entradas) > ZIP_MAX_ARQUIVOS or total > ZIP_MAX_BYTES:
+                        resultados.append({"path": arquivo.filename, "ok": False, "error": (
+                            f"Zip excede o limite ({len(entradas)} arquivos, {total} bytes; "
+                            f"max. {ZIP_MAX_ARQUIVOS} arquivos, {ZIP_MAX_BYTES} bytes).")})
+                        continue
+                    for info in entradas:
+                        with zf.open(info) as origem:
+                            gravar(info.filename, origem, info.file_size)
+            except zipfile.BadZipFile:
+                resultados.append({"path": arquivo.filename, "ok": False, "error": "Zip invalido."})
+            continue
+        gravar(paths.pop(0) if paths else arquivo.filename, arquivo.file)
+
+    return resultados
+
+
+@app.post("/fotos/{job_id}")
+async def receber_fotos_lote(
+    job_id: str,
+    arquivos: List[UploadFile] = File(...),
+    paths: Optional[List[str]] = Form(None),
+):
+    """
+    Recebe várias fotos numa única requisição multipart/form-data.
+    - 'arquivos': uma parte por foto e/ou arquivos .zip com a estrutura de pastas.
+    - 'paths' (opcional): path relativo de cada parte não-zip, na mesma ordem;
+      se ausente, usa o nome do arquivo enviado.
+    Retorna o resultado por arquivo.
+    """
+    try:
+        work = await _em_thread(_work_dir_do_job, job_id)
+        resultados = await _em_thread(_salvar_lote, work, arquivos, paths)
+    finally:
+        for arquivo in arquivos:
+            await arquivo.close()
+
+    ok = sum(1 for r in resultados if r["ok"])
+    print(f"[INFO] Lote de fotos salvo: {ok}/{len(resultados)} | job={job_id}")
+    return JSONResponse({"ok": ok == len(resultados), "resultados": resultados})
+
+
+@app.get("/fotos/{job_id}/faltando")
+def fotos_faltando(job_id: str):
+    """
+    Pré-verificação antes de /gerar: lista as fotos incluídas no laudo que
+    ainda não estão no job ([{id_vistoria, secao, foto, figura}]).
+    Vistorias inexistentes na planilha vêm em 'erros'.
+    """
+    job = _get_job(job_id)
+    work = _work_dir_do_job(job_id)
+    lote = bool(job.get("ids_vistoria"))
+
+    # lote gera com a planilha completa; usa a mesma carga para aproveitar o cache
+    faltando, erros = _no_pool(_faltando_no_processo, work,
+                               job.get("ids_vistoria") or [job["id_vistoria"]], False if lote else None)
+    return JSONResponse({"ok": not faltando and not erros, "faltando": faltando, "erros": erros})
+
+
+def _sha256_arquivo(caminho: str) -> str:
+    sha = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+@app.post("/manifesto/{job_id}")
+def manifesto(job_id: str, p: Optional[PayloadManifesto] = None):
+    """
+    Lista as fotos que o(s) laudo(s) do job vão usar (só as incluídas no laudo
+    desta vistoria e do canteiro do empreendimento) e quais ainda faltam.
+    Com 'hashes' (path -> sha256), fotos que o servidor já tem de envios
+    anteriores são colocadas no job sem novo upload; 'faltando' traz só o que
+    o cliente precisa enviar. Vistorias inexistentes vêm em 'erros'.
+    """
+    job = _get_job(job_id)
+    work = _work_dir_do_job(job_id)
+    lote = bool(job.get("ids_vistoria"))
+    hashes = {normalizar_rel_path(k): v.lower() for k, v in ((p and p.hashes) or {}).items()}
+    # a planilha pode trazer só o nome do arquivo (ver IndiceFotos.encontrar)
+    hashes_por_nome = {}
+    for rel, h in hashes.items():
+        hashes_por_nome.setdefault(os.path.basename(rel), h)
+
+    fotos, erros = _no_pool(_manifesto_no_processo, work,
+                            job.get("ids_vistoria") or [job["id_vistoria"]], False if lote else None)
+
+    indice = IndiceFotos(work)
+    faltando, reaproveitadas = [], []
+    for foto in fotos:
+        rel = normalizar_rel_path(foto)
+        blob_hash = hashes.get(rel) or hashes_por_nome.get(os.path.basename(rel))
+        atual = indice.encontrar(foto)
+        if atual and (blob_hash is None or _sha256_arquivo(atual) == blob_hash):
+            continue
+        blob = _blob_path(blob_hash) if blob_hash else None
+        if blob and os.path.exists(blob) and rel and ".." not in rel.split("/"):
+            _, destino = _destino_foto(work, rel)
+            _novo_arquivo(destino)
+            _copiar_blob(blob_hash, destino)
+            reaproveitadas.append(foto)
+            continue
+        faltando.append(foto)
+
+    print(f"[INFO] Manifesto job={job_id}: {len(fotos)} foto(s), {len(reaproveitadas)} reaproveitada(s), "
+          f"{len(faltando)} faltando")
+    return JSONResponse({"fotos": fotos, "faltando": faltando, "reaproveitadas": reaproveitadas, "erros": erros})
+
+
 @app.post("/gerar/{job_id}")
-async def gerar(job_id: str, background_tasks: BackgroundTasks):
-    """Dispara a geração do laudo após todas as fotos terem sido enviadas."""
+async def gerar(job_id: str):
+    """
+    Dispara a geração do laudo após todas as fotos terem sido enviadas.
+    Com a fila de geração cheia responde 429 com Retry-After; o job continua
+    em aguardando_fotos e pode ser disparado de novo.
+    """
+    await _em_thread(_disparar_geracao, job_id)
+    return JSONResponse({"ok": True, "job_id": job_id}, status_code=202)
+
+
+def _disparar_geracao(job_id: str):
     job = _get_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job nao encontrado.")
@@ -296,26 +1046,88 @@ async def gerar(job_id: str, background_tasks: BackgroundTasks):
             detail=f"Job em status inesperado: {job.get('status')}. Esperado: aguardando_fotos."
         )
 
-    background_tasks.add_task(_processar_job_v2, job_id)
+    _processar_job_v2(job_id)
     print(f"[INFO] Geracao disparada para job {job_id}")
-    return JSONResponse({"ok": True, "job_id": job_id}, status_code=202)
 
 
 @app.get("/status/{job_id}")
 def status(job_id: str):
-    """Retorna o status atual do job."""
+    """Retorna o status atual do job (status=queued e posicao_fila enquanto aguarda a fila de geração)."""
+    return JSONResponse(_resposta_status(job_id))
+
+
+def _resposta_status(job_id: str) -> dict:
     job = _get_job(job_id)
     if job is None:
         raise HTTPException(status_code=404, detail="Job nao encontrado.")
     resposta = {"status": job["status"]}
+    posicao = _posicao_na_fila(job_id) if job["status"] == "running" else None
+    if posicao is not None:
+        resposta["status"] = "queued"
+        resposta["posicao_fila"] = posicao
     if job["status"] == "error":
         resposta["error"] = job["error"]
-    return JSONResponse(resposta)
+    if job.get("itens"):
+        itens = job["itens"]
+        resposta["progresso"] = {
+            "total": len(itens),
+            "concluidos": sum(1 for i in itens if i["status"] == "done"),
+            "erros": sum(1 for i in itens if i["status"] == "error"),
+        }
+        resposta["itens"] = [
+            {k: i[k] for k in ("id_vistoria", "status", "error") if i[k] is not None}
+            for i in itens
+        ]
+    return resposta
+
+
+@app.get("/status/{job_id}/aguardar")
+async def status_aguardar(job_id: str, versao: Optional[int] = None, espera: float = 30):
+    """
+    Long-poll do status. Sem 'versao' responde na hora; com a 'versao' da
+    resposta anterior, segura a requisição até o job mudar ou passarem
+    'espera' segundos (máx. STATUS_ESPERA_MAX) e responde o status atual.
+    """
+    if versao is not None:
+        await _aguardar_mudanca(job_id, versao, min(max(espera, 0), STATUS_ESPERA_MAX))
+    atual = _versao_job(job_id)
+    resposta = await _em_thread(_resposta_status, job_id)
+    return JSONResponse({**resposta, "versao": atual})
+
+
+@app.get("/status/{job_id}/eventos")
+async def status_eventos(job_id: str):
+    """
+    Server-Sent Events com as mudanças de status do job: um evento 'status'
+    (mesmo JSON de /status) a cada mudança, comentário de keep-alive a cada
+    STATUS_SSE_PING segundos sem mudança; o stream termina em done/error.
+    """
+    versao = _versao_job(job_id)
+    primeira = await _em_thread(_resposta_status, job_id)
+
+    async def fluxo():
+        nonlocal versao
+        resposta, anterior = primeira, None
+        while True:
+            if resposta != anterior:
+                yield f"id: {versao}\nevent: status\ndata: {json.dumps(resposta)}\n\n"
+                anterior = resposta
+                if resposta["status"] in ("done", "error"):
+                    return
+            else:
+                yield ": ping\n\n"
+            versao = await _aguardar_mudanca(job_id, versao, STATUS_SSE_PING)
+            try:
+                resposta = await _em_thread(_resposta_status, job_id)
+            except HTTPException as e:
+                yield f"event: erro\ndata: {json.dumps({'detail': e.detail})}\n\n"
+                return
 
+    return StreamingResponse(fluxo(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-@app.get("/result/{job_id}")
-def result(job_id: str):
-    """Retorna o laudo gerado em base64 e remove o job."""
+
+def _job_concluido(job_id: str) -> dict:
     job = _get_job(job_id)
     if job is None:
         raise HTTPException(status_code=404, detail="Job nao encontrado.")
@@ -324,6 +1136,78 @@ def result(job_id: str):
             status_code=400,
             detail=f"Job ainda nao concluido. Status atual: {job['status']}"
         )
-    result_data = job["result"]
+    return job
+
+
+def _resultado_lote(job_id: str, job: dict, formato: str):
+    if formato not in ("base64", "zip"):
+        raise HTTPException(status_code=400, detail="Formato invalido para lote. Use 'base64' ou 'zip'.")
+    if formato == "zip":
+        return FileResponse(_resultado_zip_path(job_id), media_type=ZIP_MEDIA_TYPE,
+                            filename=job["result"]["filename"])
+
+    laudos = []
+    for indice, item in enumerate(job["itens"]):
+        if item["status"] != "done":
+            continue
+        with open(_resultado_item_path(job_id, indice), "rb") as f:
+            docx_b64 = base64.b64encode(f.read()).decode("utf-8")
+        laudos.append({"id_vistoria": item["id_vistoria"], "filename": item["filename"], "docx_base64": docx_b64})
+    erros = [{"id_vistoria": i["id_vistoria"], "error": i["error"]} for i in job["itens"] if i["status"] == "error"]
+    _delete_job(job_id)
+    return JSONResponse({"laudos": laudos, "erros": erros})
+
+
+@app.get("/result/{job_id}")
+def result(job_id: str, formato: str = "base64"):
+    """
+    Retorna o laudo gerado.
+    - formato=base64 (padrão, compatibilidade): JSON com docx_base64; remove o job.
+    - formato=docx: download binário em streaming (Content-Length e Range);
+      o job fica disponível para novas requisições até expirar.
+    Em jobs de lote: formato=base64 (lista de laudos, remove o job) ou
+    formato=zip (todos os laudos num .zip, em streaming).
+    """
+    job = _job_concluido(job_id)
+    if job.get("itens"):
+        return _resultado_lote(job_id, job, formato)
+    if formato not in ("base64", "docx"):
+        raise HTTPException(status_code=400, detail="Formato invalido. Use 'base64' ou 'docx'.")
+
+    caminho = _resultado_path(job_id)
+    if not os.path.exists(caminho):
+        raise HTTPException(status_code=404, detail="Arquivo do laudo nao encontrado.")
+
+    if formato == "docx":
+        return FileResponse(caminho, media_type=DOCX_MEDIA_TYPE, filename=job["result"]["filename"])
+
+    with open(caminho, "rb") as f:
+        docx_b64 = base64.b64encode(f.read()).decode("utf-8")
+    result_data = {**job["result"], "docx_base64": docx_b64}
     _delete_job(job_id)
     return JSONResponse(result_data)
+
+
+@app.get("/result/{job_id}/{id_vistoria}")
+def result_item(job_id: str, id_vistoria: str, formato: str = "docx"):
+    """
+    Laudo de uma vistoria de um job de lote, baixado separadamente.
+    formato=docx (padrão, streaming) ou base64. Não remove o job.
+    """
+    job = _job_concluido(job_id)
+    itens = job.get("itens") or []
+    indice = next((i for i, item in enumerate(itens) if item["id_vistoria"] == id_vistoria), None)
+    if indice is None:
+        raise HTTPException(status_code=404, detail="Vistoria nao pertence a este job.")
+    item = itens[indice]
+    if item["status"] != "done":
+        raise HTTPException(status_code=400, detail=f"Laudo nao gerado: {item['error']}")
+    if formato not in ("base64", "docx"):
+        raise HTTPException(status_code=400, detail="Formato invalido. Use 'base64' ou 'docx'.")
+
+    caminho = _resultado_item_path(job_id, indice)
+    if formato == "docx":
+        return FileResponse(caminho, media_type=DOCX_MEDIA_TYPE, filename=item["filename"])
+    with open(caminho, "rb") as f:
+        docx_b64 = base64.b64encode(f.read()).decode("utf-8")
+    return JSONResponse({"filename": item["filename"], "docx_base64": docx_b64})
@@ -0,0 +1,90 @@
+"""
+Benchmark do registro de jobs: latência de _get_job e _get_job + _set_job
+com 10/50/200 jobs vivos, comparando o arquivo único antigo
+(/tmp/laudo_jobs.json com o Excel em base64 dentro do registro) com um
+arquivo JSON por job (app._get_job / app._set_job).
+
+Uso: python bench/bench_job_store.py [ops_por_ponto] [kb_do_excel]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app  # noqa: E402
+
+
+# ─────────────────────── Registro antigo (arquivo único) ───────────────────────
+
+class RegistroAntigo:
+    def __init__(self, arquivo: str):
+        self.arquivo = arquivo
+        self.lock = threading.Lock()
+
+    def _ler_jobs(self) -> dict:
+        if not os.path.exists(self.arquivo):
+            return {}
+        with open(self.arquivo, "r") as f:
+            return json.load(f)
+
+    def _salvar_jobs(self, jobs: dict):
+        with open(self.arquivo, "w") as f:
+            json.dump(jobs, f)
+
+    def get(self, job_id: str) -> dict:
+        with self.lock:
+            return self._ler_jobs().get(job_id)
+
+    def set(self, job_id: str, dados: dict):
+        with self.lock:
+            jobs = self._ler_jobs()
+            jobs[job_id] = dados
+            self._salvar_jobs(jobs)
+
+
+def _medir(fn, ops: int) -> float:
+    inicio = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - inicio) / ops * 1e3
+
+
+def main():
+    ops = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    kb_excel = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    excel_b64 = base64.b64encode(os.urandom(kb_excel * 1024)).decode()
+
+    print(f"{ops} operações por ponto, Excel de {kb_excel} KB por job pendente")
+    print(f"{'jobs':>6}  {'antigo get / get+set':>24}  {'novo get / get+set':>22}")
+    for n_jobs in (10, 50, 200):
+        with tempfile.TemporaryDirectory() as tmp:
+            antigo = RegistroAntigo(os.path.join(tmp, "laudo_jobs.json"))
+            app.JOBS_DIR = os.path.join(tmp, "jobs")
+            os.makedirs(app.JOBS_DIR)
+
+            ids = [str(uuid.uuid4()) for _ in range(n_jobs)]
+            jobs = {}
+            for job_id in ids:
+                base = {"status": "aguardando_fotos", "criado_em": time.time(),
+                        "id_vistoria": "V1", "work_dir": tmp}
+                jobs[job_id] = {**base, "excel_base64": excel_b64}
+                app._set_job(job_id, base)
+            antigo._salvar_jobs(jobs)
+
+            alvo = ids[n_jobs // 2]
+            antigo_get = _medir(lambda: antigo.get(alvo), ops)
+            antigo_set = _medir(lambda: antigo.set(alvo, {**antigo.get(alvo), "status": "running"}), ops)
+            novo_get = _medir(lambda: app._get_job(alvo), ops)
+            novo_set = _medir(lambda: app._set_job(alvo, {**app._get_job(alvo), "status": "running"}), ops)
+
+        print(f"{n_jobs:>6}  {antigo_get:8.2f} / {antigo_set:8.2f} ms    {novo_get:7.2f} / {novo_set:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Benchmark de montar_ambientes com uma vistoria sintética de centenas de
+ambientes: a versão anterior (uma máscara booleana sobre o índice de fotos,
+os sistemas e as ocorrências para cada ambiente/sistema/ocorrência, mantida
+aqui como montar_ambientes_antigo) contra gerar_laudo.montar_ambientes
+(índices agrupados uma vez). Também confere que as duas produzem o mesmo
+contexto.
+
+Uso: python bench/bench_montar_ambientes.py [n_ambientes ...]   (padrão: 50 300 800)
+"""
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gerar_laudo import (  # noqa: E402
+    PlanoFotos, atribuir_figuras, montar_ambientes, encontrar_col_tipo, safe_str,
+)
+
+ID_VISTORIA = "V1"
+
+
+def vistoria_sintetica(n_ambientes, sistemas_por_ambiente=4, ocorrencias_por_sistema=2,
+                       fotos_gerais=3, fotos_por_ocorrencia=2):
+    """Planilhas (indice_fotos, itens, sistemas, ocorrencias) de uma vistoria com n_ambientes."""
+    indice, itens, sistemas, ocorrencias = [], [], [], []
+
+    def foto(tipo, id_item, id_sis=None, id_oc=None, ordem=0):
+        fid = len(indice) + 1
+        indice.append({
+            "ID_Foto_Indice": fid, "ID_Vistoria": ID_VISTORIA, "ID_Empreendimento": "E1",
+            "ID_Item": id_item, "ID_Sistema": id_sis, "ID_Ocorrencia": id_oc,
+            "Tipo": tipo, "Ordem": ordem, "Incluir_no_Laudo": fid % 17 != 0,
+            "Foto": f"f{fid}.jpg", "Legenda": f"Legenda {fid}",
+        })
+
+    for a in range(n_ambientes):
+        id_item = f"I{a}"
+        itens.append({"ID_Item": id_item, "ID_Vistoria": ID_VISTORIA, "Ambiente": f"Ambiente {a}"})
+        for k in range(fotos_gerais):
+            foto("Ambiente", id_item, ordem=k)
+        for s in range(sistemas_por_ambiente):
+            id_sis = f"{id_item}-S{s}"
+            sistemas.append({"ID_Sistema": id_sis, "ID_Item": id_item,
+                             "Elemento_Nome": "" if s == 3 and a % 5 == 0 else f"Elemento {s}",
+                             "Acabamento_Nome": "Cerâmica", "Conservacao": "Bom"})
+            for o in range(ocorrencias_por_sistema if s % 2 == 0 else 0):
+                id_oc = f"{id_sis}-O{o}"
+                ocorrencias.append({"ID_Ocorrencia": id_oc, "ID_Sistema": id_sis,
+                                    "Ocorrencia": "Fissura", "Local": "Canto" if o else None})
+                for k in range(fotos_por_ocorrencia):
+                    foto("Ocorrência", id_item, id_sis, id_oc, ordem=k)
+
+    return (pd.DataFrame(indice), pd.DataFrame(itens),
+            pd.DataFrame(sistemas), pd.DataFrame(ocorrencias))
+
+
+def montar_ambientes_antigo(indice_fotos, itens, sistemas, ocorrencias, id_vistoria):
+    """montar_ambientes antes dos índices agrupados (indice_fotos já com Figura_calc)."""
+    itens_vist = itens[itens["ID_Vistoria"] == id_vistoria]
+    df_if = indice_fotos.copy()
+    col_tipo = encontrar_col_tipo(df_if)
+    df_if["Tipo_clean"] = df_if[col_tipo].astype(str).str.strip()
+
+    ambientes_ctx = []
+    tem_col_id_oc = "ID_Ocorrencia" in df_if.columns
+
+    for _, item_row in itens_vist.iterrows():
+        id_item = item_row["ID_Item"]
+        nome_amb = item_row["Ambiente"]
+
+        base_mask = (
+            (df_if["ID_Item"] == id_item) &
+            (df_if["Tipo_clean"] == "Ambiente") &
+            (df_if["Incluir_no_Laudo"] == True)
+        )
+        if tem_col_id_oc:
+            idoc = df_if["ID_Ocorrencia"]
+            oc_vazia = (
+                idoc.isna() |
+                idoc.astype(str).str.strip().eq("") |
+                idoc.astype(str).str.strip().eq("0")
+            )
+            fotos_gerais = df_if[base_mask & oc_vazia]
+        else:
+            fotos_gerais = df_if[base_mask]
+
+        figs_gerais = sorted(
+            int(f) for f in fotos_gerais["Figura_calc"].dropna().tolist()
+        ) if not fotos_gerais.empty else []
+
+        fotos_amb_todas = df_if[
+            (df_if["ID_Item"] == id_item) &
+            (df_if["Tipo_clean"].isin(["Ambiente", "Ocorrência"])) &
+            (df_if["Incluir_no_Laudo"] == True)
+        ]
+        if not figs_gerais and not fotos_amb_todas.empty:
+            figs_gerais = sorted(
+                int(f) for f in fotos_amb_todas["Figura_calc"].dropna().tolist()
+            )
+
+        if not figs_gerais:
+            ref_figuras = ""
+        elif len(figs_gerais) == 1:
+            ref_figuras = f"Figura(s) {figs_gerais[0]}"
+        else:
+            ref_figuras = f"Figura(s) {figs_gerais[0]} a {figs_gerais[-1]}"
+
+        sis_amb = sistemas[sistemas["ID_Item"] == id_item]
+        linhas = []
+
+        for _, sis_row in sis_amb.iterrows():
+            id_sis = sis_row["ID_Sistema"]
+            elemento = safe_str(sis_row.get("Elemento_Nome", sis_row.get("Elemento", ""))).strip()
+            if not elemento:
+                continue
+            acabamento = safe_str(sis_row.get("Acabamento_Nome", sis_row.get("Acabamento", ""))).strip()
+            conservacao = safe_str(sis_row.get("Conservacao", "")).strip()
+
+            occ_sis = ocorrencias[ocorrencias["ID_Sistema"] == id_sis]
+            if occ_sis.empty:
+                linhas.append({"elemento": elemento, "acabamento": acabamento, "conservacao": conservacao,
+                               "ocorrencia": "", "local": "", "figuras": ""})
+                continue
+            for _, occ_row in occ_sis.iterrows():
+                id_oc = occ_row["ID_Ocorrencia"]
+                fotos_occ = df_if[
+                    (df_if["ID_Sistema"] == id_sis) &
+                    (df_if["ID_Ocorrencia"] == id_oc) &
+                    (df_if["Incluir_no_Laudo"] == True)
+                ]
+                figs_occ = sorted(
+                    int(f) for f in fotos_occ["Figura_calc"].dropna().tolist()
+                ) if not fotos_occ.empty else []
+                if not figs_occ:
+                    figuras_str = ""
+                elif len(figs_occ) == 1:
+                    figuras_str = str(figs_occ[0])
+                else:
+                    figuras_str = f"{figs_occ[0]} a {figs_occ[-1]}"
+                linhas.append({
+                    "elemento": elemento, "acabamento": acabamento, "conservacao": conservacao,
+                    "ocorrencia": safe_str(occ_row.get("Ocorrencia", "")).strip(),
+                    "local": safe_str(occ_row.get("Local", "")).strip(),
+                    "figuras": figuras_str,
+                })
+
+        ambientes_ctx.append({"nome": nome_amb, "ref_figuras": ref_figuras, "linhas": linhas})
+
+    return ambientes_ctx
+
+
+def _medir(fn):
+    inicio = time.perf_counter()
+    resultado = fn()
+    return time.perf_counter() - inicio, resultado
+
+
+def main():
+    tamanhos = [int(n) for n in sys.argv[1:]] or [50, 300, 800]
+    print(f"{'ambientes':>9} {'fotos':>7} {'antes':>9} {'depois':>9} {'ganho':>7}  iguais")
+    for n in tamanhos:
+        indice_fotos, itens, sistemas, ocorrencias = vistoria_sintetica(n)
+        plano = PlanoFotos(indice_fotos, ID_VISTORIA, "E1")
+        atribuir_figuras(plano, itens, sistemas, ocorrencias, ID_VISTORIA)
+
+        t_antes, antes = _medir(lambda: montar_ambientes_antigo(
+            plano.numeradas(), itens, sistemas, ocorrencias, ID_VISTORIA))
+        t_depois, depois = _medir(lambda: montar_ambientes(plano, itens, sistemas, ocorrencias, ID_VISTORIA))
+        print(f"{n:>9} {len(indice_fotos):>7} {t_antes:>8.2f}s {t_depois:>8.2f}s "
+              f"{t_antes / t_depois:>6.1f}x  {antes == depois}")
+
+
+if __name__ == "__main__":
+    main()
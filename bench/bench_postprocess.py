@@ -0,0 +1,132 @@
+"""
+Benchmark da limpeza de espaços entre tabelas do relatório fotográfico com
+um laudo sintético de N fotos (2 por tabela, parágrafos vazios e legendas
+entre as tabelas): a versão anterior (serializava o XML de cada tabela e
+parágrafo para procurar desenhos, mantida aqui como
+remover_espacos_antigo) contra
+gerar_laudo.remover_espacos_entre_tabelas_fotograficas. Também confere que
+as duas deixam o mesmo documento.
+
+Uso: python bench/bench_postprocess.py [n_fotos] [repeticoes]   (padrão: 300 5)
+"""
+import io
+import os
+import sys
+import time
+
+from docx import Document
+from docx.shared import Cm
+from docx.text.paragraph import Paragraph
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gerar_laudo import remover_espacos_entre_tabelas_fotograficas  # noqa: E402
+
+
+def laudo_sintetico(n_fotos: int) -> bytes:
+    """DOCX com texto inicial, uma tabela de vistoria e n_fotos em tabelas de 2 fotos."""
+    foto = io.BytesIO()
+    Image.new("RGB", (64, 48), (120, 160, 80)).save(foto, "JPEG")
+
+    doc = Document()
+    for k in range(40):
+        doc.add_paragraph(f"Parágrafo de texto {k}" if k % 3 else "")
+    vistoria = doc.add_table(rows=30, cols=3)
+    vistoria.cell(0, 0).text, vistoria.cell(0, 1).text = "Elemento", "Acabamento"
+    doc.add_paragraph("")
+
+    for t in range(0, n_fotos, 2):
+        tabela = doc.add_table(rows=2, cols=2)
+        for c in range(2):
+            foto.seek(0)
+            tabela.cell(0, c).paragraphs[0].add_run().add_picture(foto, width=Cm(8))
+            tabela.cell(1, c).text = f"Figura {t + c + 4} – legenda"
+        for _ in range(1 + t % 3):
+            doc.add_paragraph("")
+        if t % 20 == 18:
+            doc.add_paragraph("RELATÓRIO FOTOGRÁFICO – continuação")
+
+    saida = io.BytesIO()
+    doc.save(saida)
+    return saida.getvalue()
+
+
+# ─────────────────────── Versão anterior ───────────────────────
+
+def _is_empty_paragraph(p):
+    if p.text and p.text.strip():
+        return False
+    xml = p._p.xml
+    if "<w:drawing" in xml or "<w:pict" in xml:
+        return False
+    return True
+
+
+def remover_espacos_antigo(doc):
+    body = doc.element.body
+    children = list(body.iterchildren())
+
+    def is_tbl(el):
+        return el.tag.endswith('}tbl')
+
+    def is_p(el):
+        return el.tag.endswith('}p')
+
+    tbl_has_img = {}
+    for idx, el in enumerate(children):
+        if is_tbl(el):
+            xml = el.xml
+            tbl_has_img[idx] = ("<w:drawing" in xml) or ("<pic:pic" in xml) or ("graphicData" in xml)
+
+    def next_nonempty_index(i):
+        j = i + 1
+        while j < len(children):
+            elj = children[j]
+            if is_p(elj) and _is_empty_paragraph(Paragraph(elj, doc)):
+                j += 1
+                continue
+            return j
+        return None
+
+    to_remove = []
+    for i, el in enumerate(children):
+        if not is_p(el) or not _is_empty_paragraph(Paragraph(el, doc)):
+            continue
+        j_prev = i - 1 if i > 0 else None
+        j_next = next_nonempty_index(i)
+        if j_prev is None or j_next is None:
+            continue
+        if is_tbl(children[j_prev]) and is_tbl(children[j_next]):
+            if tbl_has_img.get(j_prev, False) and tbl_has_img.get(j_next, False):
+                to_remove.append(el)
+
+    for el in to_remove:
+        body.remove(el)
+
+
+def _medir(fn, docx: bytes, repeticoes: int):
+    tempos = []
+    for _ in range(repeticoes):
+        doc = Document(io.BytesIO(docx))
+        inicio = time.perf_counter()
+        fn(doc)
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos) * 1e3, doc.element.body.xml
+
+
+def main():
+    n_fotos = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    docx = laudo_sintetico(n_fotos)
+    n_elementos = len(Document(io.BytesIO(docx)).element.body)
+
+    t_antes, xml_antes = _medir(remover_espacos_antigo, docx, repeticoes)
+    t_depois, xml_depois = _medir(remover_espacos_entre_tabelas_fotograficas, docx, repeticoes)
+    print(f"{n_fotos} fotos, {n_elementos} elementos no body (melhor de {repeticoes})")
+    print(f"antes {t_antes:.1f} ms | depois {t_depois:.1f} ms | "
+          f"{t_antes / t_depois:.1f}x | mesmo documento: {xml_antes == xml_depois}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Teste de carga: latência de GET /status/{job_id} (p50/p99/máx.) com o
+servidor ocioso e com uploads de fotos em andamento.
+
+Sobe o app com uvicorn numa porta local, cria um job e mede /status por
+alguns segundos sem carga; depois mantém UPLOADS clientes enviando fotos de
+MB megabytes sem parar (base64 em POST /foto/{id} ou multipart em
+POST /foto/{id}/arquivo) e mede de novo.
+
+Uso: python bench/load_status_during_uploads.py [b64|multipart] [porta] [uploads] [mb] [segundos]
+     (padrão: b64 8765 4 8 10)
+"""
+import os
+import sys
+import json
+import time
+import base64
+import threading
+import subprocess
+
+import requests
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def _resumo(nome: str, latencias: list):
+    latencias = sorted(latencias)
+
+    def p(q):
+        return latencias[min(len(latencias) - 1, int(q * len(latencias)))] * 1e3
+
+    print(f"{nome:>28}: n={len(latencias):4d} p50={p(.5):7.1f}ms p99={p(.99):7.1f}ms "
+          f"max={latencias[-1] * 1e3:7.1f}ms")
+
+
+def main():
+    modo = sys.argv[1] if len(sys.argv) > 1 else "b64"
+    porta = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    n_uploads = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    mb = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+    segundos = float(sys.argv[5]) if len(sys.argv) > 5 else 10
+    if modo not in ("b64", "multipart"):
+        sys.exit("modo deve ser b64 ou multipart")
+
+    url = f"http://127.0.0.1:{porta}"
+    servidor = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(porta), "--log-level", "warning"],
+        cwd=RAIZ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            try:
+                requests.get(url + "/health", timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+
+        # /iniciar só grava o workbook; o teste não gera laudo, basta um conteúdo qualquer
+        excel = base64.b64encode(b"planilha de teste").decode()
+        job_id = requests.post(url + "/iniciar", json={"id_vistoria": "V1", "excel_base64": excel}).json()["job_id"]
+
+        foto = os.urandom(mb * 1024 * 1024)
+        corpo_b64 = json.dumps({"path": "Fotos_imovel_Images/grande.jpg",
+                                "b64": base64.b64encode(foto).decode()}).encode()
+
+        def medir(duracao):
+            latencias = []
+            fim = time.time() + duracao
+            with requests.Session() as s:
+                while time.time() < fim:
+                    inicio = time.perf_counter()
+                    s.get(f"{url}/status/{job_id}")
+                    latencias.append(time.perf_counter() - inicio)
+                    time.sleep(0.01)
+            return latencias
+
+        _resumo("/status ocioso", medir(3))
+
+        parar = threading.Event()
+        enviados = [0] * n_uploads
+
+        def enviar(i):
+            with requests.Session() as s:
+                while not parar.is_set():
+                    if modo == "b64":
+                        s.post(f"{url}/foto/{job_id}", data=corpo_b64,
+                               headers={"content-type": "application/json"})
+                    else:
+                        s.post(f"{url}/foto/{job_id}/arquivo",
+                               data={"path": f"Fotos_imovel_Images/g{i}.jpg"}, files={"arquivo": ("g.jpg", foto)})
+                    enviados[i] += 1
+
+        threads = [threading.Thread(target=enviar, args=(i,)) for i in range(n_uploads)]
+        for t in threads:
+            t.start()
+        time.sleep(0.5)
+        _resumo(f"/status c/ {n_uploads} uploads {modo}", medir(segundos))
+        parar.set()
+        for t in threads:
+            t.join()
+        print(f"{'uploads de ' + str(mb) + ' MB':>28}: {sum(enviados)} em ~{segundos:.0f}s")
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,32 @@
 import os
+import io
 import sys
+import hashlib
+import pickle
+import shutil
+import stat
 import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+from pandas.io.parsers import TextParser
+from openpyxl import load_workbook
 from PIL import Image
 from docxtpl import DocxTemplate, InlineImage
 from docx.shared import Cm
+from docx.oxml.ns import qn
 from docx import Document
 
-# Diretório base: onde está este script
+# Caminhos padrão usados apenas pela linha de comando (gerar_laudo / __main__).
+# A API reentrante (renderizar_laudo) recebe todos os caminhos explicitamente.
 BASE_DIR = os.getenv("LAUDO_BASE_DIR", os.path.dirname(os.path.abspath(__file__)))
 
 EXCEL_PATH = os.path.join(BASE_DIR, "Cautelar.xlsx")
 TEMPLATE_PATH = os.path.join(BASE_DIR, "tamplete.docx")
 OUTPUT_DIR = os.path.join(BASE_DIR, "saida")
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
 # --- Ajuste para execução em nuvem (Render) ---
 def refresh_paths():
     """Recalcula caminhos globais a partir do LAUDO_BASE_DIR (se definido)."""
@@ -26,24 +37,35 @@ def refresh_paths():
     OUTPUT_DIR = os.path.join(BASE_DIR, "saida")
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# Garante que os paths iniciais estejam coerentes
-refresh_paths()
-
 
 
 # ----------------- Funções utilitárias ----------------- #
 
-def get_ci(row, target):
+def mapa_colunas(colunas):
+    """
+    Cabeçalho normalizado (strip + lower) -> nome real da coluna.
+    Em nomes repetidos vale o primeiro, como na busca de get_ci.
+    """
+    mapa = {}
+    for col in colunas:
+        mapa.setdefault(str(col).strip().lower(), col)
+    return mapa
+
+
+def get_ci(row, target, mapa=None):
     """
     Busca case-insensitive de uma coluna no DataFrame.
     Ex.: get_ci(row_emp, "Contratante")
+    Passe 'mapa' (mapa_colunas da aba) para consultar várias colunas da
+    mesma linha sem varrer o cabeçalho a cada chamada.
     """
-    tnorm = target.strip().lower()
-    for col in row.index:
-        if str(col).strip().lower() == tnorm:
-            val = row[col]
-            return "" if pd.isna(val) else val
-    return ""
+    if mapa is None:
+        mapa = mapa_colunas(row.index)
+    col = mapa.get(target.strip().lower())
+    if col is None:
+        return ""
+    val = row[col]
+    return "" if pd.isna(val) else val
 
 
 
@@ -79,9 +101,45 @@ def decimal_to_dms(value, is_lat=True):
     return f"{degrees:02d}°{minutes:02d}'{seconds:04.1f}\"{hemi}"
 
 
-def carregar_planilhas():
-    refresh_paths()
-    xls = pd.ExcelFile(EXCEL_PATH)
+def hash_conteudo(origem) -> str:
+    """sha256 de um arquivo (caminho) ou stream binário (volta o stream ao início)."""
+    h = hashlib.sha256()
+    if isinstance(origem, (str, os.PathLike)):
+        with open(origem, "rb") as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(bloco)
+    else:
+        origem.seek(0)
+        for bloco in iter(lambda: origem.read(1024 * 1024), b""):
+            h.update(bloco)
+        origem.seek(0)
+    return h.hexdigest()
+
+
+# ============================================================
+# CACHE DE PLANILHAS
+# O mesmo Cautelar.xlsx costuma ser enviado para várias vistorias seguidas.
+# As abas lidas ficam em cache pelo sha256 do arquivo: LRU em memória no
+# processo + DataFrames serializados (pickle) em disco, compartilhados entre
+# processos. Os DataFrames retornados são compartilhados: não modifique.
+# Como o disco guarda pickles, ele só é usado se a pasta for do usuário do
+# processo e ninguém mais puder gravar nela (ver _cache_planilhas_seguro).
+# ============================================================
+
+CACHE_PLANILHAS_DIR = os.getenv("LAUDO_CACHE_PLANILHAS_DIR",
+                                os.path.join(tempfile.gettempdir(), "laudo_cache_planilhas"))
+CACHE_PLANILHAS_MEMORIA = int(os.getenv("LAUDO_CACHE_PLANILHAS_MEMORIA", "8"))  # workbooks no processo
+CACHE_PLANILHAS_DISCO = int(os.getenv("LAUDO_CACHE_PLANILHAS_DISCO", "32"))     # workbooks em disco
+# carga seletiva: lê só as linhas/colunas ligadas à vistoria pedida (ver carregar_planilhas_vistoria)
+CARGA_SELETIVA = os.getenv("LAUDO_CARGA_SELETIVA", "0") == "1"
+
+_planilhas_lru = OrderedDict()
+_planilhas_lock = threading.Lock()
+_cache_planilhas_ok = None   # resultado de _cache_planilhas_seguro neste processo
+
+
+def _ler_planilhas(excel):
+    xls = pd.ExcelFile(excel)
     vistoria = pd.read_excel(xls, "Vistoria")
     empreendimento = pd.read_excel(xls, "Empreendimento")
     indice_fotos = pd.read_excel(xls, "indice_fotos")
@@ -91,6 +149,305 @@ def carregar_planilhas():
     return vistoria, empreendimento, indice_fotos, itens, sistemas, ocorrencias
 
 
+def _cache_planilhas_seguro():
+    """
+    Cria CACHE_PLANILHAS_DIR (0700) e confere que é uma pasta de verdade, do
+    usuário atual e sem escrita para grupo/outros; senão desativa o cache em
+    disco deste processo. os.makedirs(mode=...) não corrige uma pasta que já
+    existia, e um pickle de terceiros executaria código ao ser carregado.
+    """
+    global _cache_planilhas_ok
+    if _cache_planilhas_ok is not None:
+        return _cache_planilhas_ok
+    try:
+        os.makedirs(CACHE_PLANILHAS_DIR, mode=0o700, exist_ok=True)
+        st = os.lstat(CACHE_PLANILHAS_DIR)
+        problema = None
+        if not stat.S_ISDIR(st.st_mode):
+            problema = "nao e uma pasta"
+        elif hasattr(os, "getuid") and st.st_uid != os.getuid():
+            problema = f"pertence ao uid {st.st_uid}"
+        elif st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            problema = f"permissoes {oct(st.st_mode & 0o777)}"
+    except OSError as e:
+        problema = str(e)
+    _cache_planilhas_ok = problema is None
+    if problema:
+        print(f"[AVISO] Cache de planilhas em disco desativado ({CACHE_PLANILHAS_DIR}: {problema}).")
+    return _cache_planilhas_ok
+
+
+def _planilhas_do_disco(chave):
+    if not _cache_planilhas_seguro():
+        return None
+    caminho = os.path.join(CACHE_PLANILHAS_DIR, f"{chave}.pkl")
+    try:
+        with open(caminho, "rb") as f:
+            planilhas = pickle.load(f)
+        os.utime(caminho)
+        return planilhas
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # arquivo corrompido ou de outra versão do pandas: descarta
+        print(f"[AVISO] Cache de planilhas invalido ({chave}): {e}")
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+        return None
+
+
+def _planilhas_para_disco(chave, planilhas):
+    if not _cache_planilhas_seguro():
+        return
+    try:
+        caminho = os.path.join(CACHE_PLANILHAS_DIR, f"{chave}.pkl")
+        tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(planilhas, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, caminho)
+
+        arquivos = sorted(
+            (os.path.getmtime(os.path.join(CACHE_PLANILHAS_DIR, n)), n)
+            for n in os.listdir(CACHE_PLANILHAS_DIR) if n.endswith(".pkl")
+        )
+        for _, nome in arquivos[:max(0, len(arquivos) - CACHE_PLANILHAS_DISCO)]:
+            os.remove(os.path.join(CACHE_PLANILHAS_DIR, nome))
+    except OSError as e:
+        print(f"[AVISO] Nao foi possivel gravar cache de planilhas: {e}")
+
+
+def _planilhas_em_cache(chave, ler):
+    """Busca as planilhas de 'chave' no LRU/disco; se não houver, chama ler() e guarda."""
+    with _planilhas_lock:
+        planilhas = _planilhas_lru.get(chave)
+        if planilhas is not None:
+            _planilhas_lru.move_to_end(chave)
+            return planilhas
+
+    planilhas = _planilhas_do_disco(chave) if CACHE_PLANILHAS_DISCO > 0 else None
+    if planilhas is None:
+        planilhas = ler()
+        if CACHE_PLANILHAS_DISCO > 0:
+            _planilhas_para_disco(chave, planilhas)
+
+    if CACHE_PLANILHAS_MEMORIA > 0:
+        with _planilhas_lock:
+            _planilhas_lru[chave] = planilhas
+            _planilhas_lru.move_to_end(chave)
+            while len(_planilhas_lru) > CACHE_PLANILHAS_MEMORIA:
+                _planilhas_lru.popitem(last=False)
+    return planilhas
+
+
+def carregar_planilhas(excel):
+    """
+    Lê as abas usadas no laudo. 'excel' pode ser um caminho ou um stream binário.
+    Workbooks já lidos (mesmo sha256) vêm do cache em memória ou em disco.
+    """
+    if CACHE_PLANILHAS_MEMORIA <= 0 and CACHE_PLANILHAS_DISCO <= 0:
+        return _ler_planilhas(excel)
+    return _planilhas_em_cache(hash_conteudo(excel), lambda: _ler_planilhas(excel))
+
+
+# ----------------- Campos do contexto ----------------- #
+
+# Campos copiados direto das linhas de Vistoria ("v") / Empreendimento ("emp"):
+# chave no template -> (coluna, abas consultadas em ordem; vale o 1º valor não vazio).
+# Campos com tratamento (datas, coordenada, Servicos) ficam em renderizar_laudo.
+CAMPOS_CONTEXTO = {
+    # Empreendimento
+    "Contratante": ("Contratante", ("emp", "v")),
+    "Representante": ("Representante", ("emp", "v")),
+    "Setor": ("Setor", ("emp", "v")),
+    "Empreendimento": ("Empreendimento", ("emp", "v")),
+    "Endereço": ("Endereço", ("emp", "v")),
+    "ART": ("ART", ("emp", "v")),
+
+    # Identificação imóvel / vistoria
+    "Endereco_imovel": ("Endereco_imovel", ("v",)),
+    "Rua": ("Rua", ("v",)),
+    "Num": ("Num", ("v",)),
+    "Bairro": ("Bairro", ("v",)),
+    "Cidade": ("Cidade", ("v",)),
+    "Estado": ("Estado", ("v",)),
+    "Referencia": ("Referencia", ("v",)),
+
+    "Acompanhante": ("Acompanhante", ("v",)),
+    "Proprietario": ("Proprietario", ("v",)),
+    "Ocupacao": ("Ocupacao", ("v",)),
+    "Ocupante": ("Ocupante", ("v",)),
+
+    # Região / imóvel
+    "Uso": ("Uso", ("v",)),
+    "Infra_formatado": ("Infra", ("v",)),
+    "F_ter": ("F_ter", ("v",)),
+    "Fd_ter": ("Fd_ter", ("v",)),
+    "D_ter": ("D_ter", ("v",)),
+    "E_ter": ("E_ter", ("v",)),
+    "Forma": ("Forma", ("v",)),
+    "Area": ("Area", ("v",)),
+    "Fracao": ("Fracao", ("v",)),
+    "Cota": ("Cota", ("v",)),
+    "Superficie": ("Superficie", ("v",)),
+    "Inclinacao": ("Inclinacao", ("v",)),
+    "Quadra": ("Quadra", ("v",)),
+    "Tipo": ("Tipo", ("v",)),
+    "Classe": ("Classe", ("v",)),
+    "Pav": ("Pav", ("v",)),
+    "Situ": ("Situ", ("v",)),
+    "Cons": ("Cons", ("v",)),
+    "Idade": ("Idade", ("v",)),
+    "Aparente": ("Aparente", ("v",)),
+    "Padrao": ("Padrao", ("v",)),
+    "Fundacao_formatado": ("Fundacao", ("v",)),
+    "Estrutura": ("Estrutura", ("v",)),
+    "Fechamento": ("Fechamento", ("v",)),
+    "Cobertura": ("Cobertura", ("v",)),
+}
+
+
+def campos_contexto(fontes):
+    """
+    Resolve CAMPOS_CONTEXTO. fontes: {"v": (linha, mapa_colunas), "emp": (...)}.
+    """
+    context = {}
+    for chave, (coluna, abas) in CAMPOS_CONTEXTO.items():
+        val = ""
+        for aba in abas:
+            row, mapa = fontes[aba]
+            val = get_ci(row, coluna, mapa)
+            if val:
+                break
+        context[chave] = val
+    return context
+
+
+# ----------------- Carga seletiva (streaming) ----------------- #
+
+# colunas usadas pelo laudo em cada aba; Vistoria/Empreendimento são lidas
+# inteiras (uma linha cada) porque o contexto consulta várias colunas delas.
+# A coluna 'Tipo' de indice_fotos é aceita em qualquer caixa (encontrar_col_tipo).
+COLUNAS_LAUDO = {
+    "indice_fotos": {"ID_Foto_Indice", "ID_Vistoria", "ID_Empreendimento", "ID_Item", "ID_Sistema",
+                     "ID_Ocorrencia", "Ordem", "Incluir_no_Laudo", "Foto", "Legenda"},
+    "Itens_da_Vistoria": {"ID_Item", "ID_Vistoria", "Ambiente"},
+    "Sistemas": {"ID_Sistema", "ID_Item", "Elemento_Nome", "Elemento", "Acabamento_Nome",
+                 "Acabamento", "Conservacao"},
+    "Ocorrencias_Detalhes": {"ID_Ocorrencia", "ID_Sistema", "Ocorrencia", "Local"},
+}
+
+
+def _valor_celula(cell):
+    """Mesma conversão que o pandas aplica às células do openpyxl em read_excel."""
+    if cell.value is None:
+        return ""
+    if cell.data_type == "e":
+        return float("nan")
+    if cell.data_type == "n":
+        val = int(cell.value)
+        return val if val == cell.value else float(cell.value)
+    return cell.value
+
+
+def _ler_aba_filtrada(wb, aba, manter, colunas=None, coletar=()):
+    """
+    Percorre a aba em modo read-only, linha a linha, e materializa apenas as
+    linhas em que manter(valor) é verdadeiro; valor(nome_coluna) devolve a
+    célula convertida daquela linha (nome sem diferenciar maiúsculas). Só as
+    'colunas' pedidas são guardadas (todas, se None); os tipos saem iguais aos
+    de pd.read_excel. Retorna (df, {coluna: valores das linhas mantidas}) para
+    as colunas em 'coletar'.
+    """
+    coletados = {nome: set() for nome in coletar}
+    linhas = wb[aba].iter_rows()
+    cabecalho = [_valor_celula(c) for c in next(linhas, ())]
+    while cabecalho and cabecalho[-1] == "":
+        cabecalho.pop()
+    if not cabecalho:
+        return pd.DataFrame(), coletados
+
+    pos = {}
+    for i, nome in enumerate(cabecalho):
+        pos.setdefault(str(nome).strip().lower(), i)
+    if colunas is None:
+        sel = list(range(len(cabecalho)))
+    else:
+        sel = [i for i, nome in enumerate(cabecalho)
+               if nome in colunas or str(nome).strip().lower() == "tipo"]
+
+    dados = [[cabecalho[i] for i in sel]]
+    for linha in linhas:
+        def valor(nome, linha=linha):
+            i = pos.get(nome.strip().lower())
+            return _valor_celula(linha[i]) if i is not None and i < len(linha) else ""
+        if not manter(valor):
+            continue
+        dados.append([_valor_celula(linha[i]) if i < len(linha) else "" for i in sel])
+        for nome, valores in coletados.items():
+            valores.add(valor(nome))
+
+    return TextParser(dados, header=0, skip_blank_lines=False).read(), coletados
+
+
+def _ler_planilhas_vistoria(excel, id_vistoria):
+    wb = load_workbook(excel, read_only=True, data_only=True)
+    try:
+        vistoria, col = _ler_aba_filtrada(
+            wb, "Vistoria", lambda v: v("ID_Vistoria") == id_vistoria,
+            coletar=("ID_Empreendimento",))
+        ids_emp = col["ID_Empreendimento"]
+
+        empreendimento, _ = _ler_aba_filtrada(
+            wb, "Empreendimento", lambda v: v("ID_Empreendimento") in ids_emp)
+
+        itens, col = _ler_aba_filtrada(
+            wb, "Itens_da_Vistoria", lambda v: v("ID_Vistoria") == id_vistoria,
+            COLUNAS_LAUDO["Itens_da_Vistoria"], coletar=("ID_Item",))
+        ids_item = col["ID_Item"]
+
+        def foto_do_laudo(v):
+            if v("ID_Vistoria") == id_vistoria:
+                return True
+            return v("ID_Empreendimento") in ids_emp and str(v("Tipo")).strip() == "Canteiro"
+
+        # sistemas/ocorrências citados pelas fotos também entram, para que a
+        # ordem relativa usada em atribuir_figuras seja a mesma da carga completa
+        indice_fotos, col = _ler_aba_filtrada(
+            wb, "indice_fotos", foto_do_laudo, COLUNAS_LAUDO["indice_fotos"],
+            coletar=("ID_Sistema", "ID_Ocorrencia"))
+        ids_sis_fotos, ids_oc_fotos = col["ID_Sistema"], col["ID_Ocorrencia"]
+
+        sistemas, col = _ler_aba_filtrada(
+            wb, "Sistemas",
+            lambda v: v("ID_Item") in ids_item or v("ID_Sistema") in ids_sis_fotos,
+            COLUNAS_LAUDO["Sistemas"], coletar=("ID_Sistema",))
+        ids_sis = col["ID_Sistema"]
+
+        ocorrencias, _ = _ler_aba_filtrada(
+            wb, "Ocorrencias_Detalhes",
+            lambda v: v("ID_Sistema") in ids_sis or v("ID_Ocorrencia") in ids_oc_fotos,
+            COLUNAS_LAUDO["Ocorrencias_Detalhes"])
+    finally:
+        wb.close()
+    return vistoria, empreendimento, indice_fotos, itens, sistemas, ocorrencias
+
+
+def carregar_planilhas_vistoria(excel, id_vistoria):
+    """
+    Carga seletiva: mesmas abas de carregar_planilhas, mas só com as linhas
+    ligadas a id_vistoria (a vistoria, seu empreendimento, itens, sistemas,
+    ocorrências, fotos da vistoria e fotos de canteiro do empreendimento) e só
+    com as colunas que o laudo usa. O custo acompanha o tamanho de um laudo,
+    não o histórico inteiro do workbook. Também usa o cache de planilhas.
+    """
+    if CACHE_PLANILHAS_MEMORIA <= 0 and CACHE_PLANILHAS_DISCO <= 0:
+        return _ler_planilhas_vistoria(excel, id_vistoria)
+    chave = f"{hash_conteudo(excel)}_{hashlib.sha256(str(id_vistoria).encode()).hexdigest()[:16]}"
+    return _planilhas_em_cache(chave, lambda: _ler_planilhas_vistoria(excel, id_vistoria))
+
+
 def encontrar_col_tipo(df):
     for col in df.columns:
         if str(col).strip().lower() == "tipo":
@@ -98,211 +455,464 @@ def encontrar_col_tipo(df):
     raise KeyError("Coluna 'Tipo' não encontrada em indice_fotos.")
 
 
-def encontrar_imagem(path_str):
+# pastas onde a foto é procurada pelo nome quando o caminho da planilha não existe
+PASTAS_FOTOS = ("Fotos_imovel_Images", "Foto_ambiente_Images",
+                "RFoto_Images", "Fotos_canteiro_Images")
+
+
+class IndiceFotos:
     """
-    Resolve o caminho da imagem a partir da coluna Foto.
-    Aceita 'Pasta/arquivo.jpg' ou apenas 'arquivo.jpg'.
+    Arquivos de fotos_dir indexados em memória para um job: cada pasta
+    é listada uma única vez (na primeira foto que a referencia) e a busca
+    por caminho relativo ou por nome (em PASTAS_FOTOS) não toca mais o disco.
     """
-    if not isinstance(path_str, str) or not path_str:
-        return None
 
-    rel_path = path_str.replace("\\", "/")
-    full_path = os.path.join(BASE_DIR, rel_path)
-    if os.path.exists(full_path):
-        return full_path
+    def __init__(self, fotos_dir):
+        self.fotos_dir = fotos_dir
+        self._pastas = {}
+
+    def _arquivos(self, pasta_rel):
+        nomes = self._pastas.get(pasta_rel)
+        if nomes is None:
+            try:
+                with os.scandir(os.path.join(self.fotos_dir, pasta_rel)) as it:
+                    nomes = {e.name for e in it if e.is_file()}
+            except OSError:
+                nomes = set()
+            self._pastas[pasta_rel] = nomes
+        return nomes
+
+    def encontrar(self, path_str):
+        """
+        Resolve o caminho da imagem a partir da coluna Foto.
+        Aceita 'Pasta/arquivo.jpg' ou apenas 'arquivo.jpg'; None se não existir.
+        """
+        if not isinstance(path_str, str) or not path_str:
+            return None
+
+        rel_path = os.path.normpath(path_str.replace("\\", "/"))
+        if os.path.isabs(rel_path) or rel_path.startswith(".."):
+            # fora da pasta do job: não indexado, consulta direta
+            full_path = os.path.join(self.fotos_dir, rel_path)
+            if os.path.exists(full_path):
+                return full_path
+        else:
+            pasta, filename = os.path.split(rel_path)
+            if filename in self._arquivos(pasta):
+                return os.path.join(self.fotos_dir, rel_path)
+
+        filename = os.path.basename(rel_path)
+        for pasta in PASTAS_FOTOS:
+            if filename in self._arquivos(pasta):
+                return os.path.join(self.fotos_dir, pasta, filename)
+        return None
 
-    filename = os.path.basename(rel_path)
-    for pasta in ["Fotos_imovel_Images", "Foto_ambiente_Images",
-                  "RFoto_Images", "Fotos_canteiro_Images"]:
-        teste = os.path.join(BASE_DIR, pasta, filename)
-        if os.path.exists(teste):
-            return teste
 
-    print(f"[AVISO] Imagem não encontrada: {path_str}")
-    return None
+def encontrar_imagem(path_str, fotos_dir):
+    """
+    Resolve o caminho da imagem a partir da coluna Foto, dentro de fotos_dir.
+    Aceita 'Pasta/arquivo.jpg' ou apenas 'arquivo.jpg'.
+    Para várias fotos do mesmo job, use um IndiceFotos.
+    """
+    caminho = IndiceFotos(fotos_dir).encontrar(path_str)
+    if caminho is None and isinstance(path_str, str) and path_str:
+        print(f"[AVISO] Imagem não encontrada: {path_str}")
+    return caminho
 
 
 # ============================================================
 # COMPRESSÃO DE IMAGENS
 # Reduz o tamanho das fotos antes de inserir no Word,
 # evitando timeout no Render com laudos com muitas fotos.
+# Cada foto é decodificada, redimensionada e codificada UMA vez,
+# direto na resolução final da largura de impressão (cm x DPI).
 # ============================================================
 
-_temp_files = []        # rastreia temporários para limpeza
-MAX_IMG_WIDTH_PX = 1200 # largura máxima em pixels
-JPEG_QUALITY     = 72   # qualidade JPEG (0-100)
+IMG_DPI      = int(os.getenv("LAUDO_IMG_DPI", "200"))  # resolução de impressão
+JPEG_QUALITY = 72   # qualidade JPEG (0-100)
+# orçamento de memória para as imagens comprimidas de um laudo;
+# o que passar disso vai para a pasta temporária do job
+MAX_IMG_BUFFER_BYTES = int(os.getenv("LAUDO_MAX_IMG_BUFFER_MB", "64")) * 1024 * 1024
+# threads por laudo para preparar as fotos (Pillow libera o GIL em decode/resize/encode).
+# A API gera até LAUDO_GERACAO_WORKERS laudos ao mesmo tempo (um por processo),
+# então o total de decodificações simultâneas na máquina é
+# LAUDO_GERACAO_WORKERS x LAUDO_IMG_WORKERS; o padrão divide os núcleos entre
+# os processos de geração para esse produto não passar de cpu_count.
+_CPUS = os.cpu_count() or 2
+_GERACAO_WORKERS = int(os.getenv("LAUDO_GERACAO_WORKERS", str(_CPUS)))
+IMG_WORKERS = int(os.getenv("LAUDO_IMG_WORKERS", str(max(1, _CPUS // max(1, _GERACAO_WORKERS)))))
+# cache em disco das fotos já preparadas, compartilhado entre jobs e processos
+CACHE_IMG_DIR = os.getenv("LAUDO_CACHE_IMG_DIR", os.path.join(tempfile.gettempdir(), "laudo_cache_img"))
+CACHE_IMG_MAX_BYTES = int(os.getenv("LAUDO_CACHE_IMG_MAX_MB", "512")) * 1024 * 1024
+
+
+class ImagensDoJob:
+    """
+    Imagens comprimidas de UMA geração de laudo.
+    Ficam em buffers na memória (entregues direto ao InlineImage) até
+    limite_bytes; acima disso, são gravadas numa pasta temporária exclusiva
+    do job. A preparação roda num pool de até 'workers' threads do próprio
+    job. fechar() libera tudo sem afetar outros jobs.
+    """
+
+    def __init__(self, limite_bytes: int = MAX_IMG_BUFFER_BYTES, workers: int = IMG_WORKERS):
+        self.limite_bytes = limite_bytes
+        self.workers = workers
+        self.bytes_em_memoria = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._scratch = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def contar_cache(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def mapear(self, fn, itens: list) -> list:
+        """Aplica fn a cada item no pool do job; o resultado mantém a ordem de 'itens'."""
+        if self.workers <= 1 or len(itens) <= 1:
+            return [fn(item) for item in itens]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="laudo_img")
+        return list(self._executor.map(fn, itens))
+
+    def guardar(self, dados: bytes):
+        """Retorna um stream (memória) ou caminho (pasta do job) com os dados."""
+        with self._lock:
+            em_memoria = self.bytes_em_memoria + len(dados) <= self.limite_bytes
+            if em_memoria:
+                self.bytes_em_memoria += len(dados)
+            elif self._scratch is None:
+                self._scratch = tempfile.mkdtemp(prefix="laudo_img_")
+        if em_memoria:
+            return io.BytesIO(dados)
+        fd, caminho = tempfile.mkstemp(suffix=".jpg", dir=self._scratch)
+        with os.fdopen(fd, "wb") as f:
+            f.write(dados)
+        return caminho
+
+    def fechar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._scratch is not None:
+            shutil.rmtree(self._scratch, ignore_errors=True)
+            self._scratch = None
+        self.bytes_em_memoria = 0
+
+
+def largura_px(width_cm: float, dpi: int = IMG_DPI) -> int:
+    """Largura em pixels necessária para imprimir width_cm na resolução dpi."""
+    return max(1, round(width_cm / 2.54 * dpi))
+
+
+def preparar_jpeg(path: str, width_cm: float, dpi: int = IMG_DPI, qualidade: int = JPEG_QUALITY) -> bytes:
+    """
+    Converte a foto em JPEG na resolução final para width_cm (nunca amplia).
+    JPEGs grandes são decodificados já reduzidos (draft), evitando decodificar
+    a resolução cheia só para descartá-la no resize.
+    """
+    alvo = largura_px(width_cm, dpi)
+    with Image.open(path) as img:
+        w, h = img.size
+        if w > alvo:
+            img.draft("RGB", (alvo, max(1, h * alvo // w)))
+        if img.mode in ("RGBA", "LA", "P"):
+            if img.mode == "P":
+                img = img.convert("RGBA")
+            fundo = Image.new("RGB", img.size, (255, 255, 255))
+            fundo.paste(img, mask=img.split()[-1])
+            img = fundo
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        w, h = img.size
+        if w > alvo:
+            img = img.resize((alvo, max(1, round(h * alvo / w))), Image.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=qualidade, optimize=True)
+        return buf.getvalue()
+
+
+class CacheImagens:
+    """
+    Cache em disco de JPEGs já preparados, endereçado por conteúdo:
+    chave = sha256 do arquivo original + largura alvo em px + qualidade.
+    Gravação atômica (os.replace), então vários processos podem usar a mesma
+    pasta. Cada leitura renova o mtime do arquivo; ao passar de max_bytes, os
+    menos usados recentemente são removidos (LRU) até sobrar 90% do limite.
+    """
+
+    def __init__(self, pasta: str, max_bytes: int):
+        self.pasta = pasta
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None  # calculado na primeira gravação
+        self._lock = threading.Lock()
+
+    @property
+    def ativo(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def chave(path: str, largura: int, qualidade: int) -> str:
+        return f"{hash_conteudo(path)}_{largura}_{qualidade}"
+
+    def _caminho(self, chave: str) -> str:
+        return os.path.join(self.pasta, chave[:2], f"{chave}.jpg")
+
+    def obter(self, chave: str):
+        """Retorna os bytes em cache ou None."""
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, "rb") as f:
+                dados = f.read()
+            os.utime(caminho)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return dados
+
+    def guardar(self, chave: str, dados: bytes):
+        caminho = self._caminho(chave)
+        try:
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(dados)
+            os.replace(tmp, caminho)
+        except OSError as e:
+            print(f"[AVISO] Nao foi possivel gravar no cache de imagens: {e}")
+            return
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(tam for _, tam, _ in self._listar())
+            else:
+                self._total_bytes += len(dados)
+            if self._total_bytes > self.max_bytes:
+                self._evictar()
+
+    def _listar(self):
+        arquivos = []
+        for raiz, _, nomes in os.walk(self.pasta):
+            for nome in nomes:
+                if not nome.endswith(".jpg"):
+                    continue
+                caminho = os.path.join(raiz, nome)
+                try:
+                    st = os.stat(caminho)
+                except OSError:
+                    continue
+                arquivos.append((st.st_mtime, st.st_size, caminho))
+        return arquivos
+
+    def _evictar(self):
+        arquivos = sorted(self._listar())
+        total = sum(tam for _, tam, _ in arquivos)
+        alvo = int(self.max_bytes * 0.9)
+        for _, tam, caminho in arquivos:
+            if total <= alvo:
+                break
+            try:
+                os.remove(caminho)
+            except OSError:
+                continue
+            total -= tam
+        self._total_bytes = total
 
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._total_bytes}
 
-def compress_image(path: str) -> str:
+
+cache_imagens = CacheImagens(CACHE_IMG_DIR, CACHE_IMG_MAX_BYTES)
+
+
+def compress_image(path: str, width_cm: float, imagens: ImagensDoJob):
     """
-    Redimensiona e comprime a imagem antes de inserir no Word.
-    Retorna o caminho de um arquivo temporário JPEG comprimido.
-    Se falhar, retorna o path original sem interromper o processo.
+    Redimensiona e comprime a imagem para a largura de impressão antes de inserir no Word.
+    Consulta o cache_imagens antes de abrir a foto com o Pillow.
+    Retorna o JPEG comprimido guardado em 'imagens' (buffer em memória ou
+    arquivo na pasta do job). Se falhar, retorna o path original sem
+    interromper o processo.
     """
     if not path or not os.path.exists(path):
         return path
     try:
-        with Image.open(path) as img:
-            if img.mode not in ("RGB", "L"):
-                img = img.convert("RGB")
-            w, h = img.size
-            if w > MAX_IMG_WIDTH_PX:
-                ratio = MAX_IMG_WIDTH_PX / w
-                img = img.resize((MAX_IMG_WIDTH_PX, int(h * ratio)), Image.LANCZOS)
-            tmp = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False)
-            tmp.close()
-            img.save(tmp.name, "JPEG", quality=JPEG_QUALITY, optimize=True)
-            _temp_files.append(tmp.name)
-            return tmp.name
+        if not cache_imagens.ativo:
+            return imagens.guardar(preparar_jpeg(path, width_cm))
+        chave = cache_imagens.chave(path, largura_px(width_cm), JPEG_QUALITY)
+        dados = cache_imagens.obter(chave)
+        imagens.contar_cache(dados is not None)
+        if dados is None:
+            dados = preparar_jpeg(path, width_cm)
+            cache_imagens.guardar(chave, dados)
+        return imagens.guardar(dados)
     except Exception as e:
         print(f"[AVISO] Nao foi possivel comprimir imagem {path}: {e}")
         return path
 
 
-def cleanup_temp_files():
-    """Remove os arquivos temporarios de imagens comprimidas apos geracao do laudo."""
-    for f in _temp_files:
-        try:
-            if os.path.exists(f):
-                os.remove(f)
-        except Exception:
-            pass
-    _temp_files.clear()
+def inline_images(doc, paths, width_cm, imagens):
+    """
+    Cria os InlineImage de uma lista de fotos, com largura fixa em cm e altura proporcional.
+    APLICA COMPRESSAO automatica antes de inserir no documento, em paralelo
+    no pool do job; a lista retornada segue a ordem de 'paths' ('' se não houver foto).
+    """
+    comprimidas = imagens.mapear(lambda p: compress_image(p, width_cm, imagens) if p else None, paths)
+    return [
+        InlineImage(doc, c, width=Cm(width_cm)) if p else ""
+        for p, c in zip(paths, comprimidas)
+    ]
 
 
-def inline_image(doc, path, width_cm):
-    """
-    Cria um InlineImage com largura fixa em cm e altura proporcional.
-    APLICA COMPRESSAO automatica antes de inserir no documento.
+class PlanoFotos:
     """
-    if not path:
-        return ""
-    compressed = compress_image(path)   # comprime antes de inserir
-    return InlineImage(doc, compressed, width=Cm(width_cm))
+    Índice de fotos de um laudo, preparado uma única vez e compartilhado por
+    todos os blocos: Tipo_clean calculado, só Incluir_no_Laudo == True e
+    particionado nas três seções do laudo:
+
+    - localizacao: ID_Vistoria, Tipo = Localização
+    - vistoria:    ID_Vistoria, Tipo = Ambiente/Ocorrência
+    - canteiro:    ID_Empreendimento, Tipo = Canteiro
 
+    Depois de atribuir_figuras, cada seção fica ordenada por Figura_calc.
+    """
 
-def atribuir_figuras(indice_fotos, itens, sistemas, ocorrencias, id_vistoria, id_emp, inicio=4):
+    def __init__(self, indice_fotos, id_vistoria, id_emp):
+        col_tipo = encontrar_col_tipo(indice_fotos)
+        df = indice_fotos[indice_fotos["Incluir_no_Laudo"] == True]
+        df = df.assign(Tipo_clean=df[col_tipo].astype(str).str.strip(), Figura_calc=pd.NA)
+
+        tipo = df["Tipo_clean"]
+        da_vistoria = df["ID_Vistoria"] == id_vistoria
+        self.localizacao = df[da_vistoria & (tipo == "Localização")]
+        self.vistoria = df[da_vistoria & tipo.isin(["Ambiente", "Ocorrência"])]
+        self.canteiro = df[(df["ID_Empreendimento"] == id_emp) & (tipo == "Canteiro")]
+
+    def resolver_arquivos(self, fotos):
+        """Preenche Caminho_foto (IndiceFotos.encontrar; None se faltar) nas três seções."""
+        for nome in ("localizacao", "vistoria", "canteiro"):
+            parte = getattr(self, nome)
+            caminhos = pd.Series([fotos.encontrar(f) for f in parte["Foto"]], index=parte.index, dtype=object)
+            setattr(self, nome, parte.assign(Caminho_foto=caminhos))
+
+    def faltando(self):
+        """Fotos do laudo sem arquivo (após resolver_arquivos): [{secao, foto, figura}]."""
+        faltando = []
+        for nome in ("localizacao", "vistoria", "canteiro"):
+            parte = getattr(self, nome)
+            for foto, fig, caminho in zip(parte["Foto"], parte["Figura_calc"], parte["Caminho_foto"]):
+                if caminho is None:
+                    faltando.append({
+                        "secao": nome,
+                        "foto": safe_str(foto),
+                        "figura": int(fig) if pd.notna(fig) else None,
+                    })
+        return faltando
+
+    def numeradas(self):
+        """Todas as fotos que recebem figura no laudo (as três seções)."""
+        partes = [p for p in (self.localizacao, self.vistoria, self.canteiro) if not p.empty]
+        return pd.concat(partes) if partes else self.vistoria
+
+
+def _posicoes(chaves):
+    """Série chave -> posição na tabela (em chaves repetidas vale a última)."""
+    pos = pd.Series(range(len(chaves)), index=chaves.to_numpy())
+    return pos[~pos.index.duplicated(keep="last")]
+
+
+def atribuir_figuras(plano, itens, sistemas, ocorrencias, id_vistoria, inicio=4):
     """
-    Cria coluna Figura_calc com numeração automática:
+    Preenche Figura_calc nas seções do plano com numeração automática:
 
-    1) Localização   (ID_Vistoria, Tipo = Localização)
+    1) Localização
        - ordenadas por Ordem
-    2) Vistoria      (ID_Vistoria, Tipo = Ambiente/Ocorrência)
+    2) Vistoria
        - Ordem global baseada na ordem das tabelas:
          Itens_da_Vistoria -> Sistemas -> Ocorrencias_Detalhes
        - Dentro de cada ambiente: fotos gerais primeiro
          (Tipo='Ambiente' e ID_Ocorrencia vazia), depois fotos de Ocorrência
-    3) Canteiro      (ID_Empreendimento, Tipo = Canteiro)
+    3) Canteiro
        - ordenadas por Ordem
+
+    Retorna o número da próxima figura.
     """
-    df = indice_fotos.copy()
-    col_tipo = encontrar_col_tipo(df)
-    df["Tipo_clean"] = df[col_tipo].astype(str).str.strip()
+    df = plano.vistoria
 
     # ---------- Mapeia a ordem de Itens, Sistemas e Ocorrências ---------- #
     itens_vist = itens[itens["ID_Vistoria"] == id_vistoria]
 
-    ordem_item = {}
-    for pos, (_, r) in enumerate(itens_vist.iterrows()):
-        ordem_item[r["ID_Item"]] = pos
-
-    ordem_sis = {}
-    for pos, (_, r) in enumerate(sistemas.iterrows()):
-        ordem_sis[r["ID_Sistema"]] = pos
+    ordem_item = _posicoes(itens_vist["ID_Item"])
+    ordem_sis = _posicoes(sistemas["ID_Sistema"])
 
     ordem_oc = {}
     if "ID_Ocorrencia" in ocorrencias.columns:
-        for pos, (_, r) in enumerate(ocorrencias.iterrows()):
-            ordem_oc[r["ID_Ocorrencia"]] = pos
+        ordem_oc = _posicoes(ocorrencias["ID_Ocorrencia"])
 
     # ---------- tipo_prior: fotos gerais antes das de ocorrência ---------- #
-    df["tipo_prior"] = 2  # padrão: 2 (Ocorrências / outros)
-
+    # 2 = Ocorrências / outros; 0 = foto geral do ambiente (Tipo=Ambiente e
+    # ID_Ocorrencia vazia); 1 = foto de "Ambiente" amarrada a ocorrência
     if "ID_Ocorrencia" in df.columns:
         idoc = df["ID_Ocorrencia"]
         oc_vazia = idoc.isna() | idoc.astype(str).str.strip().eq("")
     else:
-        oc_vazia = pd.Series([False] * len(df), index=df.index)
-
-    # 0 = foto geral do ambiente (Tipo=Ambiente e ID_Ocorrencia vazia)
-    df.loc[(df["Tipo_clean"] == "Ambiente") & oc_vazia, "tipo_prior"] = 0
-    # 1 = foto de "Ambiente" amarrada a ocorrência (se existir)
-    df.loc[(df["Tipo_clean"] == "Ambiente") & (~oc_vazia), "tipo_prior"] = 1
+        oc_vazia = pd.Series(False, index=df.index)
+    eh_ambiente = df["Tipo_clean"] == "Ambiente"
+    tipo_prior = np.where(eh_ambiente, np.where(oc_vazia, 0, 1), 2)
 
     # ---------- colunas de ordem baseadas nas tabelas originais ---------- #
-    df["ord_item"] = df.get("ID_Item").map(ordem_item).fillna(9999)
-    if "ID_Sistema" in df.columns:
-        df["ord_sis"] = df["ID_Sistema"].map(ordem_sis).fillna(9999)
-    else:
-        df["ord_sis"] = 9999
-
-    if "ID_Ocorrencia" in df.columns:
-        df["ord_oc"] = df["ID_Ocorrencia"].map(ordem_oc).fillna(9999)
-    else:
-        df["ord_oc"] = 9999
-
-    # máscaras por seção
-    m_loc = (
-        (df["ID_Vistoria"] == id_vistoria) &
-        (df["Tipo_clean"] == "Localização") &
-        (df["Incluir_no_Laudo"] == True)
-    )
-    m_vist = (
-        (df["ID_Vistoria"] == id_vistoria) &
-        (df["Tipo_clean"].isin(["Ambiente", "Ocorrência"])) &
-        (df["Incluir_no_Laudo"] == True)
-    )
-    m_cant = (
-        (df["ID_Empreendimento"] == id_emp) &
-        (df["Tipo_clean"] == "Canteiro") &
-        (df["Incluir_no_Laudo"] == True)
+    df = df.assign(
+        tipo_prior=tipo_prior,
+        ord_item=df.get("ID_Item").map(ordem_item).fillna(9999),
+        ord_sis=df["ID_Sistema"].map(ordem_sis).fillna(9999) if "ID_Sistema" in df.columns else 9999,
+        ord_oc=df["ID_Ocorrencia"].map(ordem_oc).fillna(9999) if "ID_Ocorrencia" in df.columns else 9999,
     )
+    plano.vistoria = df
 
-    df["Figura_calc"] = pd.NA
-    fig = inicio
-
-    # 1) Localização
-    if m_loc.any():
-        for idx in df[m_loc].sort_values("Ordem").index:
-            df.at[idx, "Figura_calc"] = fig
-            fig += 1
-
-    # 2) Vistoria – respeitando ordem Itens/Sistemas/Ocorrências
-    if m_vist.any():
-        cols_sort = ["ord_item", "tipo_prior", "ord_sis", "ord_oc", "Ordem", "ID_Foto_Indice"]
-        cols_sort = [c for c in cols_sort if c in df.columns]
-        for idx in df[m_vist].sort_values(cols_sort).index:
-            df.at[idx, "Figura_calc"] = fig
-            fig += 1
+    cols_sort = ["ord_item", "tipo_prior", "ord_sis", "ord_oc", "Ordem", "ID_Foto_Indice"]
+    cols_sort = [c for c in cols_sort if c in df.columns]
 
-    # 3) Canteiro
-    if m_cant.any():
-        for idx in df[m_cant].sort_values("Ordem").index:
-            df.at[idx, "Figura_calc"] = fig
-            fig += 1
+    # Numeração sequencial por seção: ordena cada seção uma vez e grava o
+    # bloco de números (a seção fica na ordem das figuras).
+    fig = inicio
+    secoes = (
+        ("localizacao", "Ordem"),   # 1) Localização
+        ("vistoria", cols_sort),    # 2) Vistoria – respeitando ordem Itens/Sistemas/Ocorrências
+        ("canteiro", "Ordem"),      # 3) Canteiro
+    )
+    for nome, ordenar_por in secoes:
+        parte = getattr(plano, nome)
+        if parte.empty:
+            continue
+        parte = parte.sort_values(ordenar_por)
+        setattr(plano, nome, parte.assign(Figura_calc=range(fig, fig + len(parte))))
+        fig += len(parte)
 
-    return df, fig
+    return fig
 
 
 # --------------- Montagem dos blocos de fotos --------------- #
 
-def montar_localizacao_rows(doc, indice_fotos, id_vistoria):
+def montar_localizacao_rows(doc, plano, imagens):
     """
     Monta as linhas de Localização em 2 colunas, com largura de 11 cm.
     """
-    df = indice_fotos.copy()
-    col_tipo = encontrar_col_tipo(df)
-    df["Tipo_clean"] = df[col_tipo].astype(str).str.strip()
-    df = df[
-        (df["ID_Vistoria"] == id_vistoria) &
-        (df["Tipo_clean"] == "Localização") &
-        (df["Incluir_no_Laudo"] == True)
-    ].sort_values("Figura_calc")
+    df = plano.localizacao
+
+    caminhos = df["Caminho_foto"].tolist()
+    imgs = inline_images(doc, caminhos, width_cm=11, imagens=imagens)  # 11 cm localização
 
     registros = []
-    for _, row in df.iterrows():
-        img_path = encontrar_imagem(row["Foto"])
-        img = inline_image(doc, img_path, width_cm=11)  # 11 cm localização
+    for (_, row), img in zip(df.iterrows(), imgs):
         fig = row.get("Figura_calc", None)
         fig = int(fig) if pd.notna(fig) else None
         legenda = row.get("Legenda", "")
@@ -324,25 +934,19 @@ def montar_localizacao_rows(doc, indice_fotos, id_vistoria):
     return rows2
 
 
-def montar_vistoria_rows(doc, indice_fotos, id_vistoria):
+def montar_vistoria_rows(doc, plano, imagens):
     """
     Relatório fotográfico da vistoria:
     usa Figura_calc (já ordenada pela lógica acima),
     em tabela de 2 colunas, largura 8 cm.
     """
-    df = indice_fotos.copy()
-    col_tipo = encontrar_col_tipo(df)
-    df["Tipo_clean"] = df[col_tipo].astype(str).str.strip()
-    df = df[
-        (df["ID_Vistoria"] == id_vistoria) &
-        (df["Tipo_clean"].isin(["Ambiente", "Ocorrência"])) &
-        (df["Incluir_no_Laudo"] == True)
-    ].sort_values("Figura_calc")
+    df = plano.vistoria
+
+    caminhos = df["Caminho_foto"].tolist()
+    imgs = inline_images(doc, caminhos, width_cm=8, imagens=imagens)  # 8 cm vistoria
 
     registros = []
-    for _, row in df.iterrows():
-        img_path = encontrar_imagem(row["Foto"])
-        img = inline_image(doc, img_path, width_cm=8)  # 8 cm vistoria
+    for (_, row), img in zip(df.iterrows(), imgs):
         fig = row.get("Figura_calc", None)
         fig = int(fig) if pd.notna(fig) else None
         registros.append({"img": img, "fig": fig})
@@ -362,24 +966,18 @@ def montar_vistoria_rows(doc, indice_fotos, id_vistoria):
     return rows2
 
 
-def montar_canteiro_rows(doc, indice_fotos, id_empreendimento):
+def montar_canteiro_rows(doc, plano, imagens):
     """
     Monta o bloco de fotos do canteiro em 2 colunas, largura 8 cm,
     usando Figura_calc para ordem.
     """
-    df = indice_fotos.copy()
-    col_tipo = encontrar_col_tipo(df)
-    df["Tipo_clean"] = df[col_tipo].astype(str).str.strip()
-    df = df[
-        (df["ID_Empreendimento"] == id_empreendimento) &
-        (df["Tipo_clean"] == "Canteiro") &
-        (df["Incluir_no_Laudo"] == True)
-    ].sort_values("Figura_calc")
+    df = plano.canteiro
+
+    caminhos = df["Caminho_foto"].tolist()
+    imgs = inline_images(doc, caminhos, width_cm=8, imagens=imagens)  # 8 cm canteiro
 
     registros = []
-    for _, row in df.iterrows():
-        img_path = encontrar_imagem(row["Foto"])
-        img = inline_image(doc, img_path, width_cm=8)  # 8 cm canteiro
+    for (_, row), img in zip(df.iterrows(), imgs):
         fig = row.get("Figura_calc", None)
         fig = int(fig) if pd.notna(fig) else None
         registros.append({"img": img, "fig": fig})
@@ -402,7 +1000,29 @@ def montar_canteiro_rows(doc, indice_fotos, id_empreendimento):
 # ----------------- Ambientes (Tabela 8) ----------------- #
 
 
-def montar_ambientes(indice_fotos, itens, sistemas, ocorrencias, id_vistoria):
+def _figuras_por_chave(df, chaves):
+    """
+    Agrupa df uma única vez: {chave: [figuras ordenadas]}.
+    Linhas com chave vazia (NaN) ficam de fora, como no filtro por igualdade.
+    """
+    colunas = [chaves] if isinstance(chaves, str) else chaves
+    if df.empty or not set(colunas) <= set(df.columns):
+        return {}
+    return {
+        chave: sorted(int(f) for f in figs.dropna().tolist())
+        for chave, figs in df.groupby(chaves, sort=False)["Figura_calc"]
+    }
+
+
+def _intervalo_figuras(figs):
+    if not figs:
+        return ""
+    if len(figs) == 1:
+        return str(figs[0])
+    return f"{figs[0]} a {figs[-1]}"
+
+
+def montar_ambientes(plano, itens, sistemas, ocorrencias, id_vistoria):
     """
     - ref_figuras (título do ambiente) usa SOMENTE fotos gerais:
         Tipo = 'Ambiente' e ID_Ocorrencia vazia.
@@ -413,61 +1033,41 @@ def montar_ambientes(indice_fotos, itens, sistemas, ocorrencias, id_vistoria):
     Melhoria:
     - remove linhas "vazias" (quando a 1ª coluna / elemento estiver vazia)
     - evita inserir 'nan' (Local/Ocorrência) no Word
+
+    Fotos, sistemas e ocorrências são indexados uma vez (por ID_Item,
+    ID_Sistema e (ID_Sistema, ID_Ocorrencia)) em vez de filtrar os
+    DataFrames inteiros a cada ambiente/sistema/ocorrência.
     """
     itens_vist = itens[itens["ID_Vistoria"] == id_vistoria]
-    df_if = indice_fotos.copy()
-    col_tipo = encontrar_col_tipo(df_if)
-    df_if["Tipo_clean"] = df_if[col_tipo].astype(str).str.strip()
+    df_if = plano.numeradas()
+
+    # --- Índices calculados uma vez ---
+    fotos_amb = df_if[df_if["Tipo_clean"] == "Ambiente"]
+    if "ID_Ocorrencia" in df_if.columns:
+        idoc = fotos_amb["ID_Ocorrencia"]
+        idoc_txt = idoc.astype(str).str.strip()
+        fotos_amb = fotos_amb[idoc.isna() | idoc_txt.eq("") | idoc_txt.eq("0")]
+    figs_gerais_por_item = _figuras_por_chave(fotos_amb, "ID_Item")
+    figs_todas_por_item = _figuras_por_chave(
+        df_if[df_if["Tipo_clean"].isin(["Ambiente", "Ocorrência"])], "ID_Item"
+    )
+    figs_por_ocorrencia = _figuras_por_chave(df_if, ["ID_Sistema", "ID_Ocorrencia"])
+    sistemas_por_item = {k: g for k, g in sistemas.groupby("ID_Item", sort=False)}
+    ocorrencias_por_sistema = {k: g for k, g in ocorrencias.groupby("ID_Sistema", sort=False)}
 
     ambientes_ctx = []
-    tem_col_id_oc = "ID_Ocorrencia" in df_if.columns
 
     for _, item_row in itens_vist.iterrows():
         id_item = item_row["ID_Item"]
         nome_amb = item_row["Ambiente"]
 
         # --- Fotos gerais do ambiente (sem ocorrência) para o título ---
-        base_mask = (
-            (df_if["ID_Item"] == id_item) &
-            (df_if["Tipo_clean"] == "Ambiente") &
-            (df_if["Incluir_no_Laudo"] == True)
-        )
-
-        if tem_col_id_oc:
-            idoc = df_if["ID_Ocorrencia"]
-            oc_vazia = (
-                idoc.isna() |
-                idoc.astype(str).str.strip().eq("") |
-                idoc.astype(str).str.strip().eq("0")
-            )
-            fotos_gerais = df_if[base_mask & oc_vazia]
-        else:
-            fotos_gerais = df_if[base_mask]
-
-        figs_gerais = sorted(
-            int(f) for f in fotos_gerais["Figura_calc"].dropna().tolist()
-        ) if not fotos_gerais.empty else []
-
         # fallback: se não tiver foto geral, usar todas as fotos do ambiente
-        fotos_amb_todas = df_if[
-            (df_if["ID_Item"] == id_item) &
-            (df_if["Tipo_clean"].isin(["Ambiente", "Ocorrência"])) &
-            (df_if["Incluir_no_Laudo"] == True)
-        ]
-        if not figs_gerais and not fotos_amb_todas.empty:
-            figs_gerais = sorted(
-                int(f) for f in fotos_amb_todas["Figura_calc"].dropna().tolist()
-            )
-
-        if not figs_gerais:
-            ref_figuras = ""
-        elif len(figs_gerais) == 1:
-            ref_figuras = f"Figura(s) {figs_gerais[0]}"
-        else:
-            ref_figuras = f"Figura(s) {figs_gerais[0]} a {figs_gerais[-1]}"
+        figs_gerais = figs_gerais_por_item.get(id_item) or figs_todas_por_item.get(id_item, [])
+        ref_figuras = f"Figura(s) {_intervalo_figuras(figs_gerais)}" if figs_gerais else ""
 
         # --- Linhas da tabela: seguem a ordem do Excel (sem reordenação por figura) ---
-        sis_amb = sistemas[sistemas["ID_Item"] == id_item]
+        sis_amb = sistemas_por_item.get(id_item, sistemas.iloc[0:0])
         linhas = []
 
         for _, sis_row in sis_amb.iterrows():
@@ -482,9 +1082,9 @@ def montar_ambientes(indice_fotos, itens, sistemas, ocorrencias, id_vistoria):
             acabamento = safe_str(sis_row.get("Acabamento_Nome", sis_row.get("Acabamento", ""))).strip()
             conservacao = safe_str(sis_row.get("Conservacao", "")).strip()
 
-            occ_sis = ocorrencias[ocorrencias["ID_Sistema"] == id_sis]
+            occ_sis = ocorrencias_por_sistema.get(id_sis)
 
-            if occ_sis.empty:
+            if occ_sis is None:
                 # sistema sem ocorrência
                 linhas.append(
                     {
@@ -502,22 +1102,6 @@ def montar_ambientes(indice_fotos, itens, sistemas, ocorrencias, id_vistoria):
                     ocorrencia_txt = safe_str(occ_row.get("Ocorrencia", "")).strip()
                     local_txt = safe_str(occ_row.get("Local", "")).strip()
 
-                    fotos_occ = df_if[
-                        (df_if["ID_Sistema"] == id_sis) &
-                        (df_if["ID_Ocorrencia"] == id_oc) &
-                        (df_if["Incluir_no_Laudo"] == True)
-                    ]
-                    figs_occ = sorted(
-                        int(f) for f in fotos_occ["Figura_calc"].dropna().tolist()
-                    ) if not fotos_occ.empty else []
-
-                    if not figs_occ:
-                        figuras_str = ""
-                    elif len(figs_occ) == 1:
-                        figuras_str = str(figs_occ[0])
-                    else:
-                        figuras_str = f"{figs_occ[0]} a {figs_occ[-1]}"
-
                     linhas.append(
                         {
                             "elemento": elemento,
@@ -525,7 +1109,7 @@ def montar_ambientes(indice_fotos, itens, sistemas, ocorrencias, id_vistoria):
                             "conservacao": conservacao,
                             "ocorrencia": ocorrencia_txt,
                             "local": local_txt,
-                            "figuras": figuras_str,
+                            "figuras": _intervalo_figuras(figs_por_ocorrencia.get((id_sis, id_oc), [])),
                         }
                     )
 
@@ -540,19 +1124,11 @@ def montar_ambientes(indice_fotos, itens, sistemas, ocorrencias, id_vistoria):
     return ambientes_ctx
 
 
-def calcular_ref_figuras_canteiro(indice_fotos, id_emp):
+def calcular_ref_figuras_canteiro(plano):
     """
     Calcula texto 'Figura(s) X' ou 'Figura(s) X a Y' para o canteiro.
     """
-    df = indice_fotos.copy()
-    col_tipo = encontrar_col_tipo(df)
-    df["Tipo_clean"] = df[col_tipo].astype(str).str.strip()
-    df = df[
-        (df["ID_Empreendimento"] == id_emp) &
-        (df["Tipo_clean"] == "Canteiro") &
-        (df["Incluir_no_Laudo"] == True)
-    ]
-
+    df = plano.canteiro
     figs = sorted(
         int(f) for f in df["Figura_calc"].dropna().tolist()
     ) if not df.empty else []
@@ -567,35 +1143,35 @@ def calcular_ref_figuras_canteiro(indice_fotos, id_emp):
 
 # --------------- Pós-processamento do DOCX (limpezas) --------------- #
 
-def _paragraph_has_drawing(paragraph):
-    """Retorna True se o parágrafo contiver imagem/shape (mesmo sem texto)."""
-    for run in paragraph.runs:
-        if run._element.xpath(".//w:drawing") or run._element.xpath(".//w:pict"):
-            return True
-    return False
+# Tags procuradas direto na árvore (sem serializar o XML para buscar texto)
+_TAGS_DESENHO = (qn("w:drawing"), qn("w:pict"))
+_TAGS_IMAGEM_TABELA = (qn("w:drawing"), qn("pic:pic"), qn("a:graphicData"))
+_W_T, _W_NO_BREAK_HYPHEN = qn("w:t"), qn("w:noBreakHyphen")
 
 
-def _remove_paragraph(paragraph):
-    p = paragraph._element
-    p.getparent().remove(p)
-    paragraph._p = paragraph._element = None
+def _contem_tag(el, tags):
+    """True se el (ou algum descendente) tiver uma das tags."""
+    return next(el.iter(*tags), None) is not None
 
 
-def _is_empty_paragraph(p):
-    """Parágrafo vazio = sem texto e sem desenho/imagem."""
-    if p.text and p.text.strip():
-        return False
-    xml = p._p.xml
+def _p_vazio(p_el):
+    """Elemento w:p sem texto e sem desenho/imagem."""
+    # Só w:t e w:noBreakHyphen geram texto não branco em p.text (tab/br viram
+    # espaço); sem eles dá para pular o p.text, que roda XPath a cada chamada.
+    pode_ter_texto = (
+        any(t.text and t.text.strip() for t in p_el.iter(_W_T))
+        or _contem_tag(p_el, (_W_NO_BREAK_HYPHEN,))
+    )
+    if pode_ter_texto:
+        texto = p_el.text
+        if texto and texto.strip():
+            return False
     # se tiver desenho/imagem, não é "vazio" para remoção
-    if "<w:drawing" in xml or "<w:pict" in xml:
-        return False
-    return True
+    return not _contem_tag(p_el, _TAGS_DESENHO)
 
 
-def _table_has_image(tbl):
-    """Heurística: tabela contém ao menos uma imagem/desenho."""
-    xml = tbl._tbl.xml
-    return ("<w:drawing" in xml) or ("<pic:pic" in xml) or ("graphicData" in xml)
+def _tbl_tem_imagem(tbl_el):
+    return _contem_tag(tbl_el, _TAGS_IMAGEM_TABELA)
 
 
 def remover_linhas_vazias_tabelas_vistoria(doc):
@@ -621,9 +1197,12 @@ def remover_espacos_entre_tabelas_fotograficas(doc):
     """
     Remove parágrafos vazios ENTRE tabelas que contêm fotos (tabelas com imagens).
     Isso elimina os 'espaços' que aparecem entre tabelas do Relatório Fotográfico, sem mexer na Vistoria.
+
+    Uma única passada pelo body: o parágrafo vazio logo após uma tabela com
+    fotos vira candidato e é removido se o próximo elemento não vazio também
+    for tabela com fotos (os parágrafos vazios seguintes ficam).
     """
     body = doc.element.body
-    children = list(body.iterchildren())
 
     def is_tbl(el):
         return el.tag.endswith('}tbl')
@@ -631,91 +1210,130 @@ def remover_espacos_entre_tabelas_fotograficas(doc):
     def is_p(el):
         return el.tag.endswith('}p')
 
-    # pré-calcula quais posições são tabelas com imagem
-    tbl_has_img = {}
-    for idx, el in enumerate(children):
-        if is_tbl(el):
-            # criar um objeto Table "wrapper" é caro; usar xml direto
-            xml = el.xml
-            tbl_has_img[idx] = ("<w:drawing" in xml) or ("<pic:pic" in xml) or ("graphicData" in xml)
-
-    # ajuda: encontrar próximo elemento relevante (não-parágrafo vazio)
-    from docx.text.paragraph import Paragraph
-
-    def paragraph_from_el(el):
-        return Paragraph(el, doc)
-
-    def next_nonempty_index(i):
-        j = i + 1
-        while j < len(children):
-            elj = children[j]
-            if is_p(elj):
-                pj = paragraph_from_el(elj)
-                if _is_empty_paragraph(pj):
-                    j += 1
-                    continue
-                return j
-            return j
-        return None
-
-    def prev_index(i):
-        j = i - 1
-        while j >= 0:
-            return j
-        return None
-
-    # marcar parágrafos vazios que ficam entre tabelas fotográficas
     to_remove = []
-    for i, el in enumerate(children):
-        if not is_p(el):
-            continue
-        p = paragraph_from_el(el)
-        if not _is_empty_paragraph(p):
-            continue
-
-        j_prev = prev_index(i)
-        j_next = next_nonempty_index(i)
-
-        if j_prev is None or j_next is None:
+    candidato = None
+    anterior_tbl_img = False  # elemento imediatamente anterior é tabela com imagem
+    for el in body.iterchildren():
+        if is_p(el) and _p_vazio(el):
+            if anterior_tbl_img:
+                candidato = el
+            anterior_tbl_img = False
             continue
 
-        if is_tbl(children[j_prev]) and is_tbl(children[j_next]):
-            if tbl_has_img.get(j_prev, False) and tbl_has_img.get(j_next, False):
-                to_remove.append(el)
+        tbl_img = is_tbl(el) and _tbl_tem_imagem(el)
+        if candidato is not None and tbl_img:
+            to_remove.append(candidato)
+        candidato = None
+        anterior_tbl_img = tbl_img
 
     for el in to_remove:
         body.remove(el)
 
 
-def postprocess_docx(out_path):
-    """Pós-processamento do DOCX gerado: (1) remove linhas vazias na Vistoria, (2) remove espaços entre tabelas com fotos."""
-    d = Document(out_path)
+def postprocessar_documento(d):
+    """
+    Pós-processamento em memória do documento já renderizado (python-docx):
+    (1) remove linhas vazias na Vistoria, (2) remove espaços entre tabelas com fotos.
+    """
     remover_linhas_vazias_tabelas_vistoria(d)
     remover_espacos_entre_tabelas_fotograficas(d)
-    d.save(out_path)
 
-def gerar_laudo(id_vistoria):
-    refresh_paths()
-    vistoria, empreendimento, indice_fotos, itens, sistemas, ocorrencias = carregar_planilhas()
+
+def postprocess_docx(origem, destino):
+    """
+    Pós-processamento de um DOCX já salvo (abre, limpa e grava de novo).
+    origem e destino podem ser caminhos ou streams binários.
+    """
+    d = Document(origem)
+    postprocessar_documento(d)
+    d.save(destino)
+
+
+def _preparar_vistoria(id_vistoria, excel, fotos_dir, carga_seletiva=None):
+    """
+    Lê as planilhas e monta o PlanoFotos da vistoria (numerado e, se
+    fotos_dir for informado, com os arquivos resolvidos).
+    Retorna (planilhas, row_v, row_emp, plano).
+    Lança ValueError se o ID_Vistoria não existir na planilha.
+    """
+    if carga_seletiva is None:
+        carga_seletiva = CARGA_SELETIVA
+    if carga_seletiva:
+        planilhas = carregar_planilhas_vistoria(excel, id_vistoria)
+    else:
+        planilhas = carregar_planilhas(excel)
+    vistoria, empreendimento, indice_fotos, itens, sistemas, ocorrencias = planilhas
 
     row_v = vistoria[vistoria["ID_Vistoria"] == id_vistoria]
     if row_v.empty:
-        print(f"[ERRO] ID_Vistoria {id_vistoria} não encontrado.")
-        return
+        raise ValueError(f"ID_Vistoria {id_vistoria} não encontrado.")
     row_v = row_v.iloc[0]
 
     id_emp = row_v["ID_Empreendimento"]
     row_emp = empreendimento[empreendimento["ID_Empreendimento"] == id_emp].iloc[0]
 
-    # numeração automática das figuras
-    indice_fotos_num, _ = atribuir_figuras(indice_fotos, itens, sistemas, ocorrencias,
-                                           id_vistoria, id_emp, inicio=4)
+    # fotos do laudo (filtradas e separadas por seção) + numeração automática
+    plano = PlanoFotos(indice_fotos, id_vistoria, id_emp)
+    atribuir_figuras(plano, itens, sistemas, ocorrencias, id_vistoria, inicio=4)
+    if fotos_dir is not None:
+        plano.resolver_arquivos(IndiceFotos(fotos_dir))
+    return planilhas, row_v, row_emp, plano
+
+
+def verificar_fotos(id_vistoria, excel, fotos_dir, carga_seletiva=None):
+    """
+    Pré-verificação das fotos de um laudo, sem renderizar:
+    lista as fotos incluídas no laudo que não existem em fotos_dir,
+    como [{secao, foto, figura}] (vazia se estiver tudo lá).
+    Lança ValueError se o ID_Vistoria não existir na planilha.
+    """
+    return _preparar_vistoria(id_vistoria, excel, fotos_dir, carga_seletiva)[3].faltando()
+
+
+def manifesto_fotos(id_vistoria, excel, carga_seletiva=None):
+    """
+    Fotos que o laudo vai usar (valores da coluna Foto, sem repetição, na
+    ordem das figuras), lidas só da planilha: permite ao cliente enviar
+    apenas essas. Lança ValueError se o ID_Vistoria não existir.
+    """
+    plano = _preparar_vistoria(id_vistoria, excel, None, carga_seletiva)[3]
+    fotos = plano.numeradas()["Foto"]
+    return list(dict.fromkeys(f for f in fotos if isinstance(f, str) and f))
+
+
+def renderizar_laudo(id_vistoria, excel, template, fotos_dir, saida, carga_seletiva=None):
+    """
+    Gera o laudo de uma vistoria sem depender de estado global, variáveis de
+    ambiente ou reload do módulo; pode ser chamada por várias threads ao mesmo tempo.
+
+    - excel: caminho ou stream do Cautelar.xlsx
+    - template: caminho ou stream do tamplete.docx
+    - fotos_dir: pasta raiz das fotos (Fotos_imovel_Images/, RFoto_Images/, ...)
+    - saida: caminho ou stream binário onde o .docx final será gravado
+    - carga_seletiva: lê só as linhas da vistoria (carregar_planilhas_vistoria);
+      padrão LAUDO_CARGA_SELETIVA
+
+    Retorna o nome sugerido do arquivo (Laudo_<Referencia>.docx).
+    Lança ValueError se o ID_Vistoria não existir na planilha.
+    """
+    planilhas, row_v, row_emp, plano = _preparar_vistoria(id_vistoria, excel, fotos_dir, carga_seletiva)
+    vistoria, empreendimento, indice_fotos, itens, sistemas, ocorrencias = planilhas
+
+    # pré-verificação: todas as fotos ausentes de uma vez, antes de renderizar
+    faltando = plano.faltando()
+    if faltando:
+        print(f"[AVISO] {len(faltando)} imagem(ns) não encontrada(s): "
+              + ", ".join(f["foto"] or "(vazio)" for f in faltando))
 
     # referência de figuras do canteiro
-    ref_fig_cant = calcular_ref_figuras_canteiro(indice_fotos_num, id_emp)
+    ref_fig_cant = calcular_ref_figuras_canteiro(plano)
+
+    # cabeçalhos normalizados uma vez por aba
+    mapa_v = mapa_colunas(vistoria.columns)
+    mapa_emp = mapa_colunas(empreendimento.columns)
 
     # coordenada em decimal -> DMS
-    coord_raw = get_ci(row_v, "Coordenada")
+    coord_raw = get_ci(row_v, "Coordenada", mapa_v)
     lat_dms = lon_dms = coord_dms = ""
 
     if coord_raw:
@@ -731,43 +1349,22 @@ def gerar_laudo(id_vistoria):
             print(f"[AVISO] Não foi possível converter coordenada '{coord_raw}': {e}")
             coord_dms = str(coord_raw)
 
-    doc = DocxTemplate(TEMPLATE_PATH)
-
-    localizacao_rows = montar_localizacao_rows(doc, indice_fotos_num, id_vistoria)
-    ambientes_ctx = montar_ambientes(indice_fotos_num, itens, sistemas, ocorrencias, id_vistoria)
-    vistoria_rows = montar_vistoria_rows(doc, indice_fotos_num, id_vistoria)
-    canteiro_rows = montar_canteiro_rows(doc, indice_fotos_num, id_emp)
+    doc = DocxTemplate(template)
 
-    data_vist = get_ci(row_v, "Data")
+    data_vist = get_ci(row_v, "Data", mapa_v)
     if data_vist:
         data_str = pd.to_datetime(data_vist).strftime("%d/%m/%Y")
     else:
         data_str = ""
 
-    data_cant = get_ci(row_emp, "Canteiro")
+    data_cant = get_ci(row_emp, "Canteiro", mapa_emp)
     if data_cant:
         data_cant_str = pd.to_datetime(data_cant).strftime("%d/%m/%Y")
     else:
         data_cant_str = ""
 
-    context = {
-        # Empreendimento
-        "Contratante": get_ci(row_emp, "Contratante") or get_ci(row_v, "Contratante"),
-        "Representante": get_ci(row_emp, "Representante") or get_ci(row_v, "Representante"),
-        "Setor": get_ci(row_emp, "Setor") or get_ci(row_v, "Setor"),
-        "Empreendimento": get_ci(row_emp, "Empreendimento") or get_ci(row_v, "Empreendimento"),
-        "Endereço": get_ci(row_emp, "Endereço") or get_ci(row_v, "Endereço"),
-        "ART": get_ci(row_emp, "ART") or get_ci(row_v, "ART"),
-
-        # Identificação imóvel / vistoria
-        "Endereco_imovel": get_ci(row_v, "Endereco_imovel"),
-        "Rua": get_ci(row_v, "Rua"),
-        "Num": get_ci(row_v, "Num"),
-        "Bairro": get_ci(row_v, "Bairro"),
-        "Cidade": get_ci(row_v, "Cidade"),
-        "Estado": get_ci(row_v, "Estado"),
-        "Referencia": get_ci(row_v, "Referencia"),
-
+    context = campos_contexto({"v": (row_v, mapa_v), "emp": (row_emp, mapa_emp)})
+    context.update({
         # Coordenadas
         "Coordenada": coord_raw,      # decimal original
         "Coordenada_DMS": coord_dms,  # ex: 10°55'29.5"S 37°04'49.0"W
@@ -775,63 +1372,51 @@ def gerar_laudo(id_vistoria):
         "Lon_DMS": lon_dms,
 
         "Data": data_str,
-        "Acompanhante": get_ci(row_v, "Acompanhante"),
-        "Proprietario": get_ci(row_v, "Proprietario"),
-        "Ocupacao": get_ci(row_v, "Ocupacao"),
-        "Ocupante": get_ci(row_v, "Ocupante"),
-
-        # Região / imóvel
-        "Uso": get_ci(row_v, "Uso"),
-        "Infra_formatado": get_ci(row_v, "Infra"),
-        "Servicos_formatado": (get_ci(row_v, "Servicos") or "").replace(",", ", "),
-        "F_ter": get_ci(row_v, "F_ter"),
-        "Fd_ter": get_ci(row_v, "Fd_ter"),
-        "D_ter": get_ci(row_v, "D_ter"),
-        "E_ter": get_ci(row_v, "E_ter"),
-        "Forma": get_ci(row_v, "Forma"),
-        "Area": get_ci(row_v, "Area"),
-        "Fracao": get_ci(row_v, "Fracao"),
-        "Cota": get_ci(row_v, "Cota"),
-        "Superficie": get_ci(row_v, "Superficie"),
-        "Inclinacao": get_ci(row_v, "Inclinacao"),
-        "Quadra": get_ci(row_v, "Quadra"),
-        "Tipo": get_ci(row_v, "Tipo"),
-        "Classe": get_ci(row_v, "Classe"),
-        "Pav": get_ci(row_v, "Pav"),
-        "Situ": get_ci(row_v, "Situ"),
-        "Cons": get_ci(row_v, "Cons"),
-        "Idade": get_ci(row_v, "Idade"),
-        "Aparente": get_ci(row_v, "Aparente"),
-        "Padrao": get_ci(row_v, "Padrao"),
-        "Fundacao_formatado": get_ci(row_v, "Fundacao"),
-        "Estrutura": get_ci(row_v, "Estrutura"),
-        "Fechamento": get_ci(row_v, "Fechamento"),
-        "Cobertura": get_ci(row_v, "Cobertura"),
+        "Servicos_formatado": (get_ci(row_v, "Servicos", mapa_v) or "").replace(",", ", "),
 
         # Canteiro
         "Canteiro": data_cant_str,
         "data_canteiro": data_cant_str,
         "Ref_Figuras_Canteiro": ref_fig_cant,
+    })
 
-        # Blocos
-        "localizacao_rows": localizacao_rows,
-        "ambientes": ambientes_ctx,
-        "vistoria_rows": vistoria_rows,
-        "canteiro_rows": canteiro_rows,
-    }
+    imagens = ImagensDoJob()
+    try:
+        context["localizacao_rows"] = montar_localizacao_rows(doc, plano, imagens)
+        context["ambientes"] = montar_ambientes(plano, itens, sistemas, ocorrencias, id_vistoria)
+        context["vistoria_rows"] = montar_vistoria_rows(doc, plano, imagens)
+        context["canteiro_rows"] = montar_canteiro_rows(doc, plano, imagens)
+
+        doc.render(context)
 
-    doc.render(context)
+        # Limpeza: remove parágrafos vazios entre as tabelas do item 10 (Relatório Fotográfico)
+        # direto na árvore renderizada; o .docx é serializado uma única vez.
+        postprocessar_documento(doc.docx)
+        doc.save(saida)
+    finally:
+        # Libera os buffers/arquivos das imagens comprimidas deste laudo
+        imagens.fechar()
+
+    if cache_imagens.ativo:
+        print(f"[INFO] Cache de imagens: {imagens.cache_hits} hit(s), {imagens.cache_misses} miss(es)")
 
     referencia = get_ci(row_v, "Referencia") or id_vistoria
-    out_name = f"Laudo_{referencia}.docx"
-    out_path = os.path.join(OUTPUT_DIR, out_name)
-    doc.save(out_path)
+    return f"Laudo_{referencia}.docx"
 
-    # Limpeza: remove parágrafos vazios entre as tabelas do item 10 (Relatório Fotográfico)
-    postprocess_docx(out_path)
 
-    # Limpeza dos arquivos temporarios de imagens comprimidas
-    cleanup_temp_files()
+def gerar_laudo(id_vistoria):
+    """Uso em linha de comando: lê e grava em LAUDO_BASE_DIR (ou na pasta do script)."""
+    refresh_paths()
+    saida = io.BytesIO()
+    try:
+        out_name = renderizar_laudo(id_vistoria, EXCEL_PATH, TEMPLATE_PATH, BASE_DIR, saida)
+    except ValueError as e:
+        print(f"[ERRO] {e}")
+        return
+
+    out_path = os.path.join(OUTPUT_DIR, out_name)
+    with open(out_path, "wb") as f:
+        f.write(saida.getvalue())
 
     print(f"[OK] Laudo gerado em: {out_path}")
 
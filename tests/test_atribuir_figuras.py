@@ -0,0 +1,174 @@
+"""
+Equivalência de atribuir_figuras (numeração por seção, em bloco) com a
+versão anterior, que numerava linha a linha com df.at. Os casos gerados
+cobrem chaves NaN, vazias, repetidas e de tipos misturados.
+"""
+import os
+import sys
+
+import pandas as pd
+from hypothesis import HealthCheck, assume, given, settings, strategies as st
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gerar_laudo import PlanoFotos, atribuir_figuras, encontrar_col_tipo  # noqa: E402
+
+
+def atribuir_figuras_anterior(indice_fotos, itens, sistemas, ocorrencias, id_vistoria, id_emp, inicio=4):
+    """Cópia da versão anterior: retorna (indice_fotos com Figura_calc, próxima figura)."""
+    df = indice_fotos.copy()
+    col_tipo = encontrar_col_tipo(df)
+    df["Tipo_clean"] = df[col_tipo].astype(str).str.strip()
+
+    itens_vist = itens[itens["ID_Vistoria"] == id_vistoria]
+
+    ordem_item = {}
+    for pos, (_, r) in enumerate(itens_vist.iterrows()):
+        ordem_item[r["ID_Item"]] = pos
+
+    ordem_sis = {}
+    for pos, (_, r) in enumerate(sistemas.iterrows()):
+        ordem_sis[r["ID_Sistema"]] = pos
+
+    ordem_oc = {}
+    if "ID_Ocorrencia" in ocorrencias.columns:
+        for pos, (_, r) in enumerate(ocorrencias.iterrows()):
+            ordem_oc[r["ID_Ocorrencia"]] = pos
+
+    df["tipo_prior"] = 2
+    if "ID_Ocorrencia" in df.columns:
+        idoc = df["ID_Ocorrencia"]
+        oc_vazia = idoc.isna() | idoc.astype(str).str.strip().eq("")
+    else:
+        oc_vazia = pd.Series([False] * len(df), index=df.index)
+    df.loc[(df["Tipo_clean"] == "Ambiente") & oc_vazia, "tipo_prior"] = 0
+    df.loc[(df["Tipo_clean"] == "Ambiente") & (~oc_vazia), "tipo_prior"] = 1
+
+    df["ord_item"] = df.get("ID_Item").map(ordem_item).fillna(9999)
+    if "ID_Sistema" in df.columns:
+        df["ord_sis"] = df["ID_Sistema"].map(ordem_sis).fillna(9999)
+    else:
+        df["ord_sis"] = 9999
+    if "ID_Ocorrencia" in df.columns:
+        df["ord_oc"] = df["ID_Ocorrencia"].map(ordem_oc).fillna(9999)
+    else:
+        df["ord_oc"] = 9999
+
+    m_loc = (
+        (df["ID_Vistoria"] == id_vistoria) &
+        (df["Tipo_clean"] == "Localização") &
+        (df["Incluir_no_Laudo"] == True)
+    )
+    m_vist = (
+        (df["ID_Vistoria"] == id_vistoria) &
+        (df["Tipo_clean"].isin(["Ambiente", "Ocorrência"])) &
+        (df["Incluir_no_Laudo"] == True)
+    )
+    m_cant = (
+        (df["ID_Empreendimento"] == id_emp) &
+        (df["Tipo_clean"] == "Canteiro") &
+        (df["Incluir_no_Laudo"] == True)
+    )
+
+    df["Figura_calc"] = pd.NA
+    fig = inicio
+    if m_loc.any():
+        for idx in df[m_loc].sort_values("Ordem").index:
+            df.at[idx, "Figura_calc"] = fig
+            fig += 1
+    if m_vist.any():
+        cols_sort = ["ord_item", "tipo_prior", "ord_sis", "ord_oc", "Ordem", "ID_Foto_Indice"]
+        cols_sort = [c for c in cols_sort if c in df.columns]
+        for idx in df[m_vist].sort_values(cols_sort).index:
+            df.at[idx, "Figura_calc"] = fig
+            fig += 1
+    if m_cant.any():
+        for idx in df[m_cant].sort_values("Ordem").index:
+            df.at[idx, "Figura_calc"] = fig
+            fig += 1
+
+    return df, fig
+
+
+# Chaves com NaN, vazias, repetidas e de tipos misturados (str/int/float).
+NAN = float("nan")
+chaves_item = st.sampled_from(["I1", "I2", "I3", 1, 2, "", None, NAN])
+chaves_sis = st.sampled_from(["S1", "S2", "S3", 7, " ", None, NAN])
+chaves_oc = st.sampled_from(["O1", "O2", "O3", 9, "", " ", None, NAN])
+
+foto = st.fixed_dictionaries({
+    "ID_Vistoria": st.sampled_from(["V1", "V2", None]),
+    "ID_Empreendimento": st.sampled_from(["E1", "E2"]),
+    "ID_Item": chaves_item,
+    "ID_Sistema": chaves_sis,
+    "ID_Ocorrencia": chaves_oc,
+    "Tipo": st.sampled_from(["Ambiente", " Ambiente", "Ocorrência", "Localização ", "Canteiro", "Outro", None]),
+    "Ordem": st.integers(0, 3),
+    "Incluir_no_Laudo": st.sampled_from([True, False, 1, NAN]),
+})
+item = st.fixed_dictionaries({"ID_Item": chaves_item, "ID_Vistoria": st.sampled_from(["V1", "V2"])})
+sistema = st.fixed_dictionaries({"ID_Sistema": chaves_sis, "ID_Item": chaves_item})
+ocorrencia = st.fixed_dictionaries({"ID_Ocorrencia": chaves_oc, "ID_Sistema": chaves_sis})
+
+
+def _tabela(linhas, colunas):
+    return pd.DataFrame(linhas, columns=colunas)
+
+
+@settings(max_examples=300, deadline=None, suppress_health_check=[HealthCheck.filter_too_much])
+@given(
+    fotos=st.lists(foto, max_size=30),
+    itens=st.lists(item, max_size=6),
+    sistemas=st.lists(sistema, max_size=6),
+    ocorrencias=st.lists(ocorrencia, max_size=6),
+    deslocamento=st.integers(0, 1000),
+    inicio=st.integers(1, 10),
+)
+def test_mesma_numeracao_da_versao_anterior(fotos, itens, sistemas, ocorrencias, deslocamento, inicio):
+    for i, f in enumerate(fotos):
+        f["ID_Foto_Indice"] = i + 1
+    indice = _tabela(fotos, ["ID_Foto_Indice", "ID_Vistoria", "ID_Empreendimento", "ID_Item",
+                             "ID_Sistema", "ID_Ocorrencia", "Tipo", "Ordem", "Incluir_no_Laudo"])
+    indice.index = indice.index * 3 + deslocamento   # índice não padrão
+    itens = _tabela(itens, ["ID_Item", "ID_Vistoria"])
+    sistemas = _tabela(sistemas, ["ID_Sistema", "ID_Item"])
+    ocorrencias = _tabela(ocorrencias, ["ID_Ocorrencia", "ID_Sistema"])
+
+    try:
+        anterior, prox_anterior = atribuir_figuras_anterior(
+            indice, itens, sistemas, ocorrencias, "V1", "E1", inicio)
+    except pd.errors.InvalidIndexError:
+        # a versão anterior quebrava com NaN repetido nas chaves; a atual trata como uma chave só
+        assume(False)
+
+    plano = PlanoFotos(indice, "V1", "E1")
+    prox = atribuir_figuras(plano, itens, sistemas, ocorrencias, "V1", inicio)
+
+    esperado = {i: int(f) for i, f in anterior["Figura_calc"].items() if pd.notna(f)}
+    obtido = {i: int(f) for i, f in plano.numeradas()["Figura_calc"].items()}
+    assert obtido == esperado
+    assert prox == prox_anterior
+
+
+def test_nan_repetido_nas_chaves_vira_uma_chave():
+    # A versão anterior podia levantar InvalidIndexError aqui (um NaN por linha
+    # no dicionário de ordem); a atual usa a última posição, como nas demais chaves.
+    indice = pd.DataFrame({
+        "ID_Foto_Indice": [1, 2, 3],
+        "ID_Vistoria": ["V1"] * 3,
+        "ID_Empreendimento": ["E1"] * 3,
+        "ID_Item": ["I2", "I1", NAN],
+        "ID_Sistema": [None] * 3,
+        "ID_Ocorrencia": [None] * 3,
+        "Tipo": ["Ambiente"] * 3,
+        "Ordem": [0, 0, 0],
+        "Incluir_no_Laudo": [True] * 3,
+    })
+    itens = pd.DataFrame({"ID_Item": ["I1", NAN, "I2", NAN], "ID_Vistoria": ["V1"] * 4})
+    sistemas = pd.DataFrame({"ID_Sistema": [], "ID_Item": []})
+    ocorrencias = pd.DataFrame({"ID_Ocorrencia": [], "ID_Sistema": []})
+
+    plano = PlanoFotos(indice, "V1", "E1")
+    assert atribuir_figuras(plano, itens, sistemas, ocorrencias, "V1") == 7
+    # I1 (posição 0), I2 (posição 2), NaN (última posição, 3)
+    assert plano.vistoria.sort_index()["Figura_calc"].tolist() == [5, 4, 6]
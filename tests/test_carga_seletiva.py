@@ -0,0 +1,102 @@
+"""
+A carga seletiva (carregar_planilhas_vistoria) tem de gerar o mesmo laudo
+que a carga completa: os tipos de cada coluna são os da coluna inteira do
+workbook, não só das linhas da vistoria (um número ao lado de uma célula
+vazia em outra vistoria continua float, "12.0").
+"""
+import io
+import os
+import sys
+import zipfile
+
+import pandas as pd
+import pytest
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+
+import gerar_laudo  # noqa: E402
+
+
+def _workbook(caminho):
+    vistoria = pd.DataFrame([
+        {"ID_Vistoria": "V1", "ID_Empreendimento": "E1", "Coordenada": "-10.924851, -37.080269",
+         "Data": "2024-03-05", "Referencia": "REF1", "Rua": "Rua A", "Num": 12,
+         "Servicos": "agua,luz", "Tipo": "Casa", "Proprietario": "Dono"},
+        # Num vazio em outra vistoria: na carga completa a coluna vira float
+        {"ID_Vistoria": "V2", "ID_Empreendimento": "E1", "Coordenada": "", "Data": "2024-03-06",
+         "Referencia": "REF2", "Rua": "Rua B", "Num": None, "Servicos": "", "Tipo": "Apto",
+         "Proprietario": "Outro"},
+    ])
+    empreendimento = pd.DataFrame([
+        {"ID_Empreendimento": "E1", "Contratante": "ACME", "Representante": "Fulano",
+         "Setor": "Norte", "Empreendimento": "Res. Teste", "Endereço": "Rua X",
+         "ART": "123", "Canteiro": "2024-02-01"},
+    ])
+    itens = pd.DataFrame([
+        {"ID_Item": "I1", "ID_Vistoria": "V1", "Ambiente": "Sala"},
+        {"ID_Item": "I2", "ID_Vistoria": "V2", "Ambiente": 7},
+    ])
+    sistemas = pd.DataFrame([
+        {"ID_Sistema": "S1", "ID_Item": "I1", "Elemento_Nome": "Piso", "Acabamento_Nome": "Ceramica",
+         "Conservacao": 3},
+        {"ID_Sistema": "S2", "ID_Item": "I2", "Elemento_Nome": "Parede", "Acabamento_Nome": "Pintura",
+         "Conservacao": None},
+    ])
+    ocorrencias = pd.DataFrame([
+        {"ID_Ocorrencia": "O1", "ID_Sistema": "S1", "Ocorrencia": "Fissura", "Local": 2},
+        {"ID_Ocorrencia": "O2", "ID_Sistema": "S2", "Ocorrencia": "Mancha", "Local": "Canto"},
+    ])
+    indice_fotos = pd.DataFrame([
+        {"ID_Foto_Indice": 1, "ID_Vistoria": "V1", "ID_Empreendimento": "E1", "ID_Item": None,
+         "ID_Sistema": None, "ID_Ocorrencia": None, "Tipo": "Localização", "Ordem": 1,
+         "Incluir_no_Laudo": True, "Foto": "Fotos_imovel_Images/a.jpg", "Legenda": "Fachada"},
+        {"ID_Foto_Indice": 2, "ID_Vistoria": "V1", "ID_Empreendimento": "E1", "ID_Item": "I1",
+         "ID_Sistema": "S1", "ID_Ocorrencia": "O1", "Tipo": "Ocorrência", "Ordem": 1,
+         "Incluir_no_Laudo": True, "Foto": "RFoto_Images/b.jpg", "Legenda": 5},
+        {"ID_Foto_Indice": 3, "ID_Vistoria": "V2", "ID_Empreendimento": "E1", "ID_Item": "I2",
+         "ID_Sistema": None, "ID_Ocorrencia": None, "Tipo": "Ambiente", "Ordem": None,
+         "Incluir_no_Laudo": False, "Foto": "Foto_ambiente_Images/c.jpg", "Legenda": "Sala"},
+        {"ID_Foto_Indice": 4, "ID_Vistoria": None, "ID_Empreendimento": "E1", "ID_Item": None,
+         "ID_Sistema": None, "ID_Ocorrencia": None, "Tipo": "Canteiro", "Ordem": 1,
+         "Incluir_no_Laudo": True, "Foto": "Fotos_canteiro_Images/d.jpg", "Legenda": "Canteiro"},
+    ])
+    with pd.ExcelWriter(caminho) as w:
+        vistoria.to_excel(w, sheet_name="Vistoria", index=False)
+        empreendimento.to_excel(w, sheet_name="Empreendimento", index=False)
+        indice_fotos.to_excel(w, sheet_name="indice_fotos", index=False)
+        itens.to_excel(w, sheet_name="Itens_da_Vistoria", index=False)
+        sistemas.to_excel(w, sheet_name="Sistemas", index=False)
+        ocorrencias.to_excel(w, sheet_name="Ocorrencias_Detalhes", index=False)
+
+
+@pytest.fixture
+def excel(tmp_path, monkeypatch):
+    monkeypatch.setattr(gerar_laudo, "CACHE_PLANILHAS_MEMORIA", 0)
+    monkeypatch.setattr(gerar_laudo, "CACHE_PLANILHAS_DISCO", 0)
+    caminho = str(tmp_path / "Cautelar.xlsx")
+    _workbook(caminho)
+    return caminho
+
+
+def _documento(excel, fotos_dir, carga_seletiva):
+    saida = io.BytesIO()
+    gerar_laudo.renderizar_laudo("V1", excel, os.path.join(RAIZ, "tamplete.docx"), fotos_dir,
+                                 saida, carga_seletiva=carga_seletiva)
+    with zipfile.ZipFile(saida) as z:
+        return z.read("word/document.xml").decode("utf-8")
+
+
+def test_tipos_das_colunas_iguais_aos_da_carga_completa(excel):
+    completa = gerar_laudo.carregar_planilhas(excel)
+    seletiva = gerar_laudo.carregar_planilhas_vistoria(excel, "V1")
+    for df_completo, df_seletivo in zip(completa, seletiva):
+        for coluna in df_seletivo.columns:
+            assert df_seletivo[coluna].dtype == df_completo[coluna].dtype, coluna
+
+
+def test_mesmo_laudo_com_e_sem_carga_seletiva(excel, tmp_path):
+    completo = _documento(excel, str(tmp_path), carga_seletiva=False)
+    seletivo = _documento(excel, str(tmp_path), carga_seletiva=True)
+    assert "12.0" in completo
+    assert seletivo == completo